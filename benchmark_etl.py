@@ -0,0 +1,223 @@
+# archivo: benchmark_etl.py (Benchmark reproducible del pipeline ETL con datos sucios sintéticos)
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+import limpieza_datos as etl
+
+try:
+    import resource # Solo Unix
+except ImportError:
+    resource = None
+
+# --- Catálogo para datos sintéticos (con las variantes "sucias" que corrige el pipeline) ---
+RAW_COLUMNS = ['ID_Transaccion', 'Fecha', 'Nombre_Cliente', 'Producto_ID', 'Descripcion_Producto',
+               'Cantidad', 'Precio_Unitario', 'Ciudad', 'Region', 'Notas']
+PRODUCTS = [ # (producto_id, variantes de descripción, precio base)
+    ('prd-001', ['Laptop Modelo X', 'laptop model x', ' LAPTOP MODELO X'], 1250.50),
+    ('prd-002', ['Teclado Inalámbrico', 'teclado inalambrico', 'Teclado  Inalámbrico '], 75.00),
+    ('prd-003', ['Monitor 24"', 'monitor 24 pulgadas', 'MONITOR 24"'], 600.00),
+    ('prd-004', ['Webcam HD', 'webcam hd'], 120.50),
+    ('prd-005', ['Mouse Ergonómico', 'mouse ergonómico ', 'MOUSE ERGONÓMICO'], 45.99),
+]
+CITIES = [ # (variantes de ciudad, región)
+    (['Madrid', 'madrid', ' MADRID'], 'Centro'),
+    (['Barcelona', 'barcelona'], 'Cataluña'),
+    (['Valencia', 'valencia '], 'Comunidad Valenciana'),
+    (['Sevilla', 'sevilla'], 'Andalucía'),
+    (['Málaga', 'málaga', 'Malaga'], 'Andalucía'),
+    (['Bilbao', 'BILBAO'], 'País Vasco'),
+    (['Zaragoza', 'zaragoza'], 'Aragón'),
+]
+CUSTOMERS = [' Juan Pérez ', 'María Gómez', 'pedro López ', 'Ana Silva', 'Carlos Null', 'Sofía Martín',
+             'Luisa Fernández', 'Javier Muñoz', 'ELENA RUIZ', 'David Romero']
+NOTES = ['Entrega Urgente', ' Cliente VIP', ' Caja dañada ', 'N/A', 'NULL', '--', '', 'Cantidad como texto']
+MISSING_MARKERS = ['', 'N/A', 'NULL', 'na', '--']
+DATE_FORMATS = ['%Y-%m-%d', '%d/%m/%Y', '%Y/%m/%d', '%b %d, %y', '%b %d %Y']
+QUANTITY_WORDS = {1: 'uno', 2: 'dos'}
+
+def _pick(rng, values, size):
+    values = np.asarray(values, dtype=object)
+    return values[rng.integers(0, len(values), size)]
+
+def _format_prices(rng, prices):
+    """Precios como texto en formatos mezclados: '1250.5', '$ 1,250.50 ', ' 600.00 '."""
+    style = rng.integers(0, 3, len(prices))
+    plain = pd.Series(prices).round(2).astype(str).to_numpy(dtype=object)
+    with_symbol = np.array([f"$ {p:,.2f} " for p in prices], dtype=object) if (style == 1).any() else plain
+    padded = np.array([f" {p:.2f} " for p in prices], dtype=object) if (style == 2).any() else plain
+    return np.where(style == 1, with_symbol, np.where(style == 2, padded, plain))
+
+def generate_dirty_sales(n_rows, seed=0, start_id=0, duplicate_rate=0.02, null_rate=0.02, date_days=1100):
+    """Genera `n_rows` filas de ventas sucias (todo texto) de forma reproducible y vectorizada.
+
+    Reproduce los defectos que limpia el pipeline: fechas en varios formatos, cantidades en
+    palabras, precios con símbolos/comas, marcadores de nulos, ids duplicados, precios no
+    positivos y variantes de mayúsculas/acentos/espacios en productos y ciudades.
+    """
+    rng = np.random.default_rng(seed)
+    ids = np.arange(start_id, start_id + n_rows)
+    duplicated = rng.random(n_rows) < duplicate_rate # Reutiliza un id anterior del mismo bloque
+    ids[duplicated] = start_id + (rng.random(duplicated.sum()) * np.maximum(ids[duplicated] - start_id, 1)).astype(int)
+    id_text = np.char.add('TX', np.char.zfill(ids.astype(str), 9)).astype(object)
+
+    days = pd.date_range('2021-01-01', periods=date_days, freq='D')
+    date_table = np.array([days.strftime(fmt) for fmt in DATE_FORMATS], dtype=object) # formatos × días
+    dates = date_table[rng.integers(0, len(DATE_FORMATS), n_rows), rng.integers(0, date_days, n_rows)]
+
+    product_idx = rng.integers(0, len(PRODUCTS), n_rows)
+    product_ids = np.array([p[0] for p in PRODUCTS], dtype=object)[product_idx]
+    product_ids = np.where(rng.random(n_rows) < 0.1, np.char.upper(product_ids.astype(str)).astype(object), product_ids)
+    descriptions = np.empty(n_rows, dtype=object)
+    base_prices = np.empty(n_rows, dtype=float)
+    for i, (_, variants, price) in enumerate(PRODUCTS):
+        mask = product_idx == i
+        descriptions[mask] = _pick(rng, variants, mask.sum())
+        base_prices[mask] = price * rng.uniform(0.95, 1.05, mask.sum())
+    base_prices[rng.random(n_rows) < 0.005] *= -1 # Precios no positivos que deben descartarse
+
+    city_idx = rng.integers(0, len(CITIES), n_rows)
+    cities = np.empty(n_rows, dtype=object)
+    for i, (variants, _) in enumerate(CITIES):
+        mask = city_idx == i
+        cities[mask] = _pick(rng, variants, mask.sum())
+    regions = np.array([c[1] for c in CITIES], dtype=object)[city_idx]
+
+    quantities = rng.integers(1, 6, n_rows)
+    quantity_text = quantities.astype(str).astype(object)
+    as_word = (rng.random(n_rows) < 0.05) & np.isin(quantities, list(QUANTITY_WORDS))
+    quantity_text[as_word] = np.vectorize(QUANTITY_WORDS.get, otypes=[object])(quantities[as_word])
+
+    df = pd.DataFrame({
+        'ID_Transaccion': id_text, 'Fecha': dates, 'Nombre_Cliente': _pick(rng, CUSTOMERS, n_rows),
+        'Producto_ID': product_ids, 'Descripcion_Producto': descriptions, 'Cantidad': quantity_text,
+        'Precio_Unitario': _format_prices(rng, base_prices), 'Ciudad': cities, 'Region': regions,
+        'Notas': _pick(rng, NOTES, n_rows),
+    })
+    for col in ['Fecha', 'Cantidad', 'Precio_Unitario', 'Nombre_Cliente', 'Region']: # Nulos explícitos e implícitos
+        missing = rng.random(n_rows) < null_rate / 2
+        df.loc[missing, col] = _pick(rng, MISSING_MARKERS, missing.sum())
+    return df
+
+def write_dirty_csv(file_path, n_rows, seed=0, chunk_rows=1_000_000):
+    """Escribe el CSV sintético por bloques (la memoria no depende de `n_rows`)."""
+    for block, start in enumerate(range(0, n_rows, chunk_rows)):
+        chunk = generate_dirty_sales(min(chunk_rows, n_rows - start), seed=seed + block, start_id=start)
+        chunk.to_csv(file_path, mode='w' if block == 0 else 'a', header=block == 0, index=False, encoding='utf-8')
+    return file_path
+
+# --- Ejecución del benchmark ---
+def _peak_memory_kb():
+    if resource is None: return None
+    scale = 1024 if sys.platform == 'darwin' else 1
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale # Procesos del modo paralelo
+    return max(own, children)
+
+def _summarize_metrics(metrics_file):
+    """Suma las métricas por etapa (varias líneas por etapa en modo streaming/paralelo) y calcula el throughput."""
+    stages = {}
+    with open(metrics_file, encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            stage = stages.setdefault(record['etapa'], {'tiempo_s': 0.0, 'cpu_s': 0.0, 'filas': 0, 'rss_pico_delta_kb': 0, 'llamadas': 0})
+            stage['tiempo_s'] += record['tiempo_s']; stage['cpu_s'] += record['cpu_s']; stage['llamadas'] += 1
+            stage['filas'] += record['filas_entrada'] or record['filas_salida'] or 0
+            stage['rss_pico_delta_kb'] = max(stage['rss_pico_delta_kb'], record['rss_pico_delta_kb'] or 0)
+    for stage in stages.values():
+        stage['filas_s'] = round(stage['filas'] / stage['tiempo_s'], 1) if stage['tiempo_s'] > 0 else None
+        stage['tiempo_s'] = round(stage['tiempo_s'], 6); stage['cpu_s'] = round(stage['cpu_s'], 6)
+    return stages
+
+def run_benchmark(n_rows, seed=0, mode='completo', workers=None, chunksize=1_000_000, workdir=None, excel=True):
+    """Genera (o reutiliza) el CSV sintético, ejecuta el pipeline con métricas y devuelve los resultados."""
+    workdir = workdir or os.path.join(tempfile.gettempdir(), 'benchmark_etl')
+    os.makedirs(workdir, exist_ok=True)
+    input_file = os.path.join(workdir, f'ventas_sucias_{n_rows}_{seed}.csv')
+    if not os.path.exists(input_file):
+        print(f"Generando {n_rows:,} filas sintéticas en {input_file}...")
+        write_dirty_csv(input_file, n_rows, seed=seed)
+    metrics_file = os.path.join(workdir, 'metricas.jsonl')
+    if os.path.exists(metrics_file): os.remove(metrics_file)
+    etl.configure_instrumentation(verbose=False, metrics_file=metrics_file)
+
+    out = lambda name: os.path.join(workdir, name)
+    targets = [('csv', {'file_path': out('datos_limpios.csv')}),
+               ('parquet', {'file_path': out('datos_limpios_parquet')}),
+               ('sql', {'db_connection_string': f"sqlite:///{out('benchmark.db')}", 'table_name': 'ventas'})]
+    start = time.perf_counter()
+    if mode == 'streaming':
+        etl.run_pipeline_streaming(input_file, targets + [('rollups', {'dir_path': out('rollups')})], chunksize=chunksize)
+    else:
+        raw_df = etl.extract_data(input_file)
+        cleaned_df = etl.apply_transformations_parallel(raw_df, n_workers=workers) if mode == 'paralelo' else etl.apply_transformations(raw_df)
+        cleaned_df.sort_values(by='fecha', inplace=True)
+        for target_format, target_kwargs in targets:
+            etl.load_data(cleaned_df, target_format=target_format, **target_kwargs)
+        etl.load_data(cleaned_df, target_format='feather', file_path=out('datos_limpios.feather'))
+        if excel:
+            etl.load_data(cleaned_df, target_format='excel', file_path=out('datos_limpios.xlsx'))
+        # Agregación del dashboard: rollups completos y una consulta filtrada sobre el cubo
+        with etl.measure_stage('dashboard:build_rollups', rows_in=len(cleaned_df)):
+            cube = etl.build_rollup_cube(cleaned_df); etl.build_rollups(cube)
+        with etl.measure_stage('dashboard:filtro_cubo', rows_in=len(cube)):
+            etl.build_rollups(cube[cube['ciudad'].isin(['Madrid', 'Sevilla'])])
+    total_time = time.perf_counter() - start
+    etl.close_connections()
+    etl.configure_instrumentation(verbose=True, metrics_file=None)
+    return {'filas': n_rows, 'semilla': seed, 'modo': mode, 'tiempo_total_s': round(total_time, 3),
+            'filas_s': round(n_rows / total_time, 1), 'memoria_pico_kb': _peak_memory_kb(),
+            'etapas': _summarize_metrics(metrics_file)}
+
+def compare_with_baseline(results, baseline, threshold=0.2, min_seconds=0.05):
+    """Imprime la comparación por etapa con la línea base y devuelve las etapas que empeoran más de `threshold`.
+
+    Las diferencias menores que `min_seconds` se ignoran (ruido de medición en etapas muy cortas).
+    """
+    regressions = []
+    print(f"\n{'Etapa':<36}{'Tiempo (s)':>12}{'Base (s)':>12}{'Cambio':>10}{'Filas/s':>14}")
+    for name, stage in results['etapas'].items():
+        base = baseline.get('etapas', {}).get(name) if baseline else None
+        change = (stage['tiempo_s'] - base['tiempo_s']) / base['tiempo_s'] if base and base['tiempo_s'] > 0 else None
+        flag = ' <-- REGRESIÓN' if change is not None and change > threshold and stage['tiempo_s'] - base['tiempo_s'] > min_seconds else ''
+        if flag: regressions.append(name)
+        print(f"{name:<36}{stage['tiempo_s']:>12.3f}{base['tiempo_s'] if base else float('nan'):>12.3f}"
+              f"{f'{change:+.0%}' if change is not None else '-':>10}{stage['filas_s'] or 0:>14,.0f}{flag}")
+    print(f"\nTotal: {results['tiempo_total_s']:.2f}s ({results['filas_s']:,.0f} filas/s). Memoria pico: {results['memoria_pico_kb']} KB")
+    if baseline:
+        print(f"Total línea base: {baseline['tiempo_total_s']:.2f}s. Memoria pico base: {baseline['memoria_pico_kb']} KB")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark reproducible del pipeline ETL con datos sucios sintéticos.")
+    parser.add_argument('--rows', type=int, default=100_000, help="Filas sintéticas a generar (1K a 100M).")
+    parser.add_argument('--seed', type=int, default=0, help="Semilla del generador.")
+    parser.add_argument('--mode', choices=['completo', 'streaming', 'paralelo'], default='completo', help="Modo del pipeline a medir.")
+    parser.add_argument('--workers', type=int, default=None, help="Procesos para el modo paralelo.")
+    parser.add_argument('--chunksize', type=int, default=1_000_000, help="Filas por bloque en modo streaming.")
+    parser.add_argument('--no-excel', action='store_true', help="No medir la escritura a Excel.")
+    parser.add_argument('--workdir', default=None, help="Directorio de trabajo (datos generados y salidas).")
+    parser.add_argument('--baseline', default='benchmark_baseline.json', help="Archivo JSON de líneas base.")
+    parser.add_argument('--save-baseline', action='store_true', help="Guardar este resultado como línea base.")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Empeoramiento relativo a partir del cual se marca una regresión.")
+    parser.add_argument('--min-seconds', type=float, default=0.05, help="Diferencia absoluta mínima (s) para marcar una regresión.")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.rows, seed=args.seed, mode=args.mode, workers=args.workers,
+                            chunksize=args.chunksize, workdir=args.workdir, excel=not args.no_excel)
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f: baselines = json.load(f)
+    key = f"{args.mode}:{args.rows}:{args.seed}" # Solo se comparan ejecuciones equivalentes
+    regressions = compare_with_baseline(results, baselines.get(key), threshold=args.threshold, min_seconds=args.min_seconds)
+    if args.save_baseline:
+        baselines[key] = results
+        with open(args.baseline, 'w', encoding='utf-8') as f: json.dump(baselines, f, ensure_ascii=False, indent=2)
+        print(f"Línea base guardada en {args.baseline} ({key}).")
+    elif regressions:
+        print(f"\nRegresiones detectadas: {', '.join(regressions)}")
+        sys.exit(1)
@@ -1,5 +1,9 @@
+import os
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow.feather as feather
+from limpieza_datos import build_rollup_cube, build_rollups
 import plotly.express as px # Para gráficos más personalizables (opcional, pero recomendado)
 
 # --- Configuración de la Página ---
@@ -11,41 +15,117 @@ st.title("📊 Dashboard de Resultados ETL - Ventas Consolidadas")
 st.markdown("Visualización de los datos limpios generados por el pipeline ETL.")
 
 # --- Cargar Datos Limpios ---
-# Intentar cargar desde el CSV generado por el pipeline
-DATA_FILE = 'datos_limpios.csv'
+# Fuentes generadas por el pipeline, en orden de preferencia (los formatos columnares cargan mucho más rápido)
+DATA_SOURCES = ['datos_limpios_parquet', 'datos_limpios.feather', 'datos_limpios.csv']
+DATA_FILE = next((path for path in DATA_SOURCES if os.path.exists(path)), DATA_SOURCES[-1])
+# Columnas necesarias para métricas y gráficos (el resto solo se carga para la tabla completa)
+ANALYSIS_COLUMNS = ['fecha', 'ciudad', 'region', 'descripcion_producto', 'cantidad', 'precio_unitario']
+# Agregados precalculados por el ETL (target 'rollups'); los gráficos solo leen estas tablas pequeñas
+ROLLUPS_DIR = 'rollups'
+# Dimensiones filtrables desde la barra lateral (además del rango de fechas)
+FILTER_COLUMNS = ['ciudad', 'region', 'descripcion_producto']
+
+def read_cleaned_data(file_path, columns=None):
+    """Lee los datos limpios desde Parquet, Feather o CSV, cargando solo `columns` si se indican."""
+    if os.path.isdir(file_path) or file_path.endswith('.parquet'):
+        df = pd.read_parquet(file_path, columns=columns, memory_map=True)
+    elif file_path.endswith(('.feather', '.arrow')):
+        df = feather.read_table(file_path, columns=columns, memory_map=True).to_pandas()
+    else:
+        df = pd.read_csv(file_path, usecols=columns, parse_dates=['fecha'])
+    return df.drop(columns=['mes'], errors='ignore') # Columna de partición del dataset Parquet
 
 @st.cache_data # Cachear la carga de datos para mejorar rendimiento
-def load_cleaned_data(file_path):
+def load_rollups(dir_path, data_file):
+    """Lee los rollups precalculados por el ETL; si no existen, los calcula una vez desde los datos limpios."""
     try:
-        # Asegurarse de parsear la fecha correctamente al cargar
-        df = pd.read_csv(file_path, parse_dates=['fecha'])
-        # Calcular ingresos por fila para análisis
-        if 'cantidad' in df.columns and 'precio_unitario' in df.columns:
-             df['ingresos'] = df['cantidad'] * df['precio_unitario']
-        return df
+        if os.path.isdir(dir_path):
+            return {os.path.splitext(name)[0]: pd.read_parquet(os.path.join(dir_path, name))
+                    for name in os.listdir(dir_path) if name.endswith('.parquet')}
+        df = read_cleaned_data(data_file, columns=ANALYSIS_COLUMNS)
+        return build_rollups(build_rollup_cube(df))
     except FileNotFoundError:
         return None
     except Exception as e:
         st.error(f"Error inesperado al cargar los datos: {e}")
         return None
 
-df_clean = load_cleaned_data(DATA_FILE)
+@st.cache_resource # Se comparte sin copiar: el DataFrame completo solo se lee, nunca se modifica
+def load_indexed_data(file_path):
+    """Carga todas las columnas ordenadas por fecha y con las dimensiones como 'category' (índice para filtrar)."""
+    df = read_cleaned_data(file_path).sort_values('fecha', kind='stable', ignore_index=True)
+    for col in FILTER_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    return df
+
+def category_mask(series, selected):
+    """Máscara de pertenencia comparando códigos categóricos (enteros) en lugar de textos."""
+    if not isinstance(series.dtype, pd.CategoricalDtype): series = series.astype('category')
+    wanted = series.cat.categories.get_indexer(list(selected))
+    # Los nulos (código -1, p. ej. 'region' vacía) nunca coinciden con una selección; sin filtro no se aplica la máscara
+    return np.isin(series.cat.codes.to_numpy(), wanted[wanted >= 0])
+
+@st.cache_data
+def filter_row_positions(_df, file_path, filters):
+    """Posiciones (ordenadas por fecha) de las filas que cumplen los filtros.
+
+    El rango de fechas se resuelve con búsqueda binaria sobre 'fecha' ordenada y las
+    dimensiones con máscaras por código categórico solo dentro de ese rango.
+    """
+    fechas = _df['fecha'].to_numpy()
+    lo = np.searchsorted(fechas, np.datetime64(filters['desde']), side='left')
+    hi = np.searchsorted(fechas, np.datetime64(filters['hasta']) + np.timedelta64(1, 'D'), side='left')
+    mask = np.ones(hi - lo, dtype=bool)
+    for col in FILTER_COLUMNS:
+        if filters[col] and col in _df.columns:
+            mask &= category_mask(_df[col].iloc[lo:hi], filters[col])
+    return lo + np.flatnonzero(mask)
+
+@st.cache_data
+def filter_rollups(_cube, dir_path, filters):
+    """Recalcula los rollups a partir del cubo (día × ciudad × región × producto) restringido a los filtros."""
+    mask = ((_cube['fecha'] >= pd.Timestamp(filters['desde'])) & (_cube['fecha'] <= pd.Timestamp(filters['hasta']))).to_numpy()
+    for col in FILTER_COLUMNS:
+        if filters[col] and col in _cube.columns:
+            mask &= category_mask(_cube[col], filters[col])
+    return build_rollups(_cube[mask])
+
+rollups = load_rollups(ROLLUPS_DIR, DATA_FILE)
 
 # --- Mostrar Mensaje si no hay Datos ---
-if df_clean is None:
+if rollups is None:
     st.error(f"❌ No se pudo cargar el archivo '{DATA_FILE}'. Asegúrate de que el pipeline ETL (`limpieza_datos.py`) se haya ejecutado correctamente.")
     st.stop() # Detener la ejecución si no hay datos
 
 st.success(f"✔️ Datos cargados exitosamente desde '{DATA_FILE}'.")
 
+# --- Filtros (barra lateral) ---
+st.sidebar.header("Filtros")
+cube = rollups['cubo']
+min_date, max_date = rollups['resumen'].iloc[0][['fecha_min', 'fecha_max']]
+date_range = st.sidebar.date_input("Rango de fechas", value=(min_date.date(), max_date.date()),
+                                   min_value=min_date.date(), max_value=max_date.date())
+if not isinstance(date_range, (tuple, list)): date_range = (date_range,)
+filters = {'desde': date_range[0], 'hasta': date_range[-1]} # Mientras se elige el rango solo hay una fecha
+filter_labels = {'ciudad': "Ciudad", 'region': "Región", 'descripcion_producto': "Producto"}
+for col in FILTER_COLUMNS:
+    options = sorted(cube[col].dropna().astype(str).unique()) if col in cube.columns else []
+    filters[col] = tuple(st.sidebar.multiselect(filter_labels[col], options, placeholder="Todos"))
+
+filters_active = (any(filters[col] for col in FILTER_COLUMNS)
+                  or filters['desde'] != min_date.date() or filters['hasta'] != max_date.date())
+view = filter_rollups(cube, ROLLUPS_DIR, filters) if filters_active else rollups
+
 # --- Resumen de Métricas Clave ---
 st.header("🚀 Resumen General")
 
-total_records = len(df_clean)
-total_revenue = df_clean['ingresos'].sum() if 'ingresos' in df_clean.columns else 0
+summary = view['resumen'].iloc[0]
+total_records = int(summary['transacciones']) if pd.notna(summary['transacciones']) else 0
+total_revenue = summary['ingresos']
 avg_transaction_value = total_revenue / total_records if total_records > 0 else 0
-start_date = df_clean['fecha'].min()
-end_date = df_clean['fecha'].max()
+start_date = summary['fecha_min']
+end_date = summary['fecha_max']
 
 # Usar columnas para mostrar métricas lado a lado
 col1, col2, col3, col4 = st.columns(4)
@@ -60,8 +140,17 @@ col4.metric("Periodo", f"{start_date.strftime('%Y-%m-%d') if pd.notna(start_date
 st.header("🔍 Exploración de Datos Limpios")
 # Usar un expander para no ocupar mucho espacio por defecto
 with st.expander("Ver Tabla de Datos Completa", expanded=False):
-    # Mostrar el dataframe interactivo
-    st.dataframe(df_clean.drop(columns=['ingresos'], errors='ignore')) # Ocultar columna calculada si se desea
+    # La tabla completa solo se lee si se pide; los filtros se evalúan en el servidor y solo se envía la página visible
+    if st.checkbox("Cargar tabla de datos", value=False):
+        full_df = load_indexed_data(DATA_FILE)
+        positions = filter_row_positions(full_df, DATA_FILE, filters)
+        page_col1, page_col2 = st.columns(2)
+        page_size = page_col1.selectbox("Filas por página", [50, 100, 500, 1000], index=1)
+        n_pages = max(1, -(-len(positions) // page_size))
+        page = page_col2.number_input(f"Página (de {n_pages:,})", min_value=1, max_value=n_pages, value=1, step=1)
+        page_positions = positions[(page - 1) * page_size:page * page_size]
+        st.caption(f"Mostrando {len(page_positions):,} de {len(positions):,} filas filtradas.")
+        st.dataframe(full_df.iloc[page_positions], hide_index=True)
 
 
 # --- Visualizaciones ---
@@ -72,8 +161,8 @@ viz_col1, viz_col2 = st.columns(2)
 
 with viz_col1:
     st.subheader("💰 Ingresos por Ciudad")
-    # Agrupar por ciudad y sumar ingresos
-    revenue_by_city = df_clean.groupby('ciudad')['ingresos'].sum().sort_values(ascending=False).reset_index()
+    # Ingresos por ciudad (rollup precalculado)
+    revenue_by_city = view['por_ciudad'].sort_values('ingresos', ascending=False)
     # Crear gráfico de barras con Plotly Express para mejor interactividad
     fig_city = px.bar(revenue_by_city,
                       x='ciudad',
@@ -86,8 +175,8 @@ with viz_col1:
 
 with viz_col2:
     st.subheader("📦 Cantidad Vendida por Producto")
-    # Agrupar por producto y sumar cantidad
-    qty_by_product = df_clean.groupby('descripcion_producto')['cantidad'].sum().sort_values(ascending=False).reset_index()
+    # Cantidad por producto (rollup precalculado)
+    qty_by_product = view['por_producto'].sort_values('cantidad', ascending=False)
     # Crear gráfico de barras
     fig_product = px.bar(qty_by_product,
                          x='cantidad',
@@ -102,12 +191,8 @@ with viz_col2:
 # --- Gráfico de Tendencia Temporal ---
 st.subheader("📅 Ingresos a lo largo del Tiempo")
 
-# Asegurarse que 'fecha' es el índice para resampling
-df_time = df_clean.set_index('fecha')
-
-# Opción de Resampling (Diario 'D', Semanal 'W', Mensual 'M' o 'ME' para fin de mes)
-# Usaremos 'ME' para agrupar por mes
-revenue_over_time = df_time.resample('ME')['ingresos'].sum().reset_index()
+# Rollup mensual precalculado (fin de mes); el resample solo rellena con 0 los meses sin ventas
+revenue_over_time = view['por_mes'].rename(columns={'mes': 'fecha'}).set_index('fecha').resample('ME')['ingresos'].sum().reset_index()
 
 # Crear gráfico de línea
 fig_time = px.line(revenue_over_time,
@@ -128,4 +213,5 @@ st.sidebar.info(
     "Usa Streamlit para la visualización."
 )
 st.sidebar.header("Fuente de Datos")
-st.sidebar.markdown(f"Datos cargados desde: `{DATA_FILE}`")
\ No newline at end of file
+st.sidebar.markdown(f"Datos cargados desde: `{DATA_FILE}`")
+st.sidebar.markdown(f"Agregados: `{ROLLUPS_DIR}/`" if os.path.isdir(ROLLUPS_DIR) else "Agregados: calculados al cargar (ejecuta el ETL para precalcularlos)")
\ No newline at end of file
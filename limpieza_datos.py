@@ -2,24 +2,102 @@
 import pandas as pd
 import numpy as np
 import re
-from sqlalchemy import create_engine
+import os
+import sys
+import contextlib
+import json
+import hashlib
+import io
+import csv
+import time
+import shutil
+import functools
+import glob
+from datetime import datetime
+try:
+    import resource # Solo Unix; en Windows no se mide la memoria pico
+except ImportError:
+    resource = None
+import argparse
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from sqlalchemy import Index, MetaData, String, Table, create_engine, delete, insert, inspect, select, text
 # from pymongo import MongoClient # Importación movida dentro del try/except
 try:
     import xlsxwriter # Necesario para formato avanzado
 except ImportError:
     print("Advertencia: Instala 'xlsxwriter' para formato Excel avanzado: pip install xlsxwriter")
 
+# --- INSTRUMENTACIÓN ---
+VERBOSE = True # False = modo silencioso: omite diagnósticos costosos (head, info, conteos de nulos, únicos)
+METRICS_FILE = None # Archivo JSON lines con métricas por etapa ('-' = salida estándar, None = desactivado)
+
+def configure_instrumentation(verbose=True, metrics_file=None):
+    """Activa/desactiva los diagnósticos detallados y define dónde se escriben las métricas por etapa."""
+    global VERBOSE, METRICS_FILE
+    VERBOSE, METRICS_FILE = verbose, metrics_file
+
+def _peak_rss_kb():
+    if resource is None: return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak # macOS lo da en bytes, Linux en KB
+
+def emit_metrics(record):
+    """Escribe un registro de métricas como una línea JSON en `METRICS_FILE`."""
+    if METRICS_FILE is None: return
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    if METRICS_FILE == '-': print(line); return
+    with open(METRICS_FILE, 'a', encoding='utf-8') as f: f.write(line + '\n')
+
+@contextlib.contextmanager
+def measure_stage(stage, rows_in=None, **extra):
+    """Mide una etapa (tiempo real, CPU, crecimiento de la memoria pico y filas) y emite sus métricas.
+
+    Devuelve un dict en el que el código medido puede fijar 'filas_salida' u otros campos.
+    """
+    record = {'etapa': stage, 'inicio': datetime.now().isoformat(timespec='milliseconds'), 'pid': os.getpid(),
+              'filas_entrada': rows_in, 'filas_salida': None, **extra}
+    wall_start, cpu_start, rss_start = time.perf_counter(), time.process_time(), _peak_rss_kb()
+    try:
+        yield record
+    finally:
+        rss_end = _peak_rss_kb()
+        record.update({
+            'tiempo_s': round(time.perf_counter() - wall_start, 6), 'cpu_s': round(time.process_time() - cpu_start, 6),
+            'rss_pico_delta_kb': rss_end - rss_start if rss_end is not None else None,
+        })
+        emit_metrics(record)
+
+def instrumented(stage):
+    """Decorador que mide una etapa con `measure_stage`; las filas se toman del primer argumento y del resultado.
+
+    `stage` puede ser un nombre o una función que lo calcula a partir de los argumentos de la llamada.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            df_in = args[0] if args else None
+            stage_name = stage(*args, **kwargs) if callable(stage) else stage
+            with measure_stage(stage_name, rows_in=len(df_in) if isinstance(df_in, pd.DataFrame) else None) as record:
+                result = func(*args, **kwargs)
+                if isinstance(result, pd.DataFrame): record['filas_salida'] = len(result)
+            return result
+        return wrapper
+    return decorator
+
 # --- EXTRACT ---
+@instrumented('extract_data')
 def extract_data(file_path):
     """Lee datos desde un archivo CSV."""
     try:
         df = pd.read_csv(file_path, dtype=str, delimiter=',')
         print(f"Datos extraídos exitosamente de {file_path}")
         print(f"Número inicial de filas: {len(df)}")
-        print("Primeras filas de datos crudos:")
-        print(df.head())
-        print("\nTipos de datos iniciales (leídos como string):")
-        df.info()
+        if VERBOSE:
+            print("Primeras filas de datos crudos:")
+            print(df.head())
+            print("\nTipos de datos iniciales (leídos como string):")
+            df.info()
         return df
     except FileNotFoundError:
         print(f"Error: El archivo {file_path} no fue encontrado.")
@@ -28,50 +106,241 @@ def extract_data(file_path):
         print(f"Error durante la extracción: {e}")
         return None
 
+def extract_data_chunks(file_path, chunksize=100_000):
+    """Lee un CSV por bloques de `chunksize` filas (generador), sin cargarlo completo en memoria."""
+    try:
+        reader = pd.read_csv(file_path, dtype=str, delimiter=',', chunksize=chunksize)
+    except FileNotFoundError:
+        print(f"Error: El archivo {file_path} no fue encontrado.")
+        return
+    except Exception as e:
+        print(f"Error durante la extracción: {e}")
+        return
+    with reader:
+        for chunk_num, chunk in enumerate(reader, start=1):
+            print(f"\nBloque {chunk_num} extraído de {file_path}: {len(chunk)} filas")
+            yield chunk
+
+SOURCE_COLUMN = 'origen' # Columna con la fuente de cada fila en la extracción multi-fuente
+SQL_SOURCE_SEPARATOR = '::' # 'sqlite:///ventas.db::tabla' o 'postgresql://.../db::SELECT ...'
+
+def expand_sources(sources):
+    """Expande patrones glob ('tiendas/*.csv.gz') en rutas; las URLs SQL se dejan tal cual."""
+    expanded = []
+    for source in sources:
+        if '://' in source or not glob.has_magic(source): expanded.append(source); continue
+        matches = sorted(glob.glob(source, recursive=True))
+        if not matches: print(f"Advertencia: El patrón {source} no coincide con ningún archivo.")
+        expanded.extend(matches)
+    return expanded
+
+def _as_text(df):
+    """Convierte todas las columnas a texto (como `dtype=str` al leer CSV), manteniendo los nulos."""
+    for col in df.columns:
+        if df[col].dtype != object or not df[col].map(type).eq(str).all():
+            df[col] = df[col].astype(str).where(df[col].notna())
+    return df
+
+EXTENDED_JSON_SCALARS = ('$oid', '$numberInt', '$numberLong', '$numberDouble', '$numberDecimal')
+
+def _from_extended_json(value):
+    """Valor plano de un tipo extendido de MongoDB (`mongoexport`): {'$date': ...} pasa a fecha ISO
+    'YYYY-MM-DD' y {'$numberLong': '5'}, {'$oid': ...}, etc. a su texto; el resto se deja igual."""
+    if not isinstance(value, dict) or len(value) != 1: return value
+    (tag, inner), = value.items()
+    if tag in EXTENDED_JSON_SCALARS: return str(inner)
+    if tag != '$date': return value
+    inner = _from_extended_json(inner) # {'$date': {'$numberLong': '<ms>'}} en modo canónico
+    is_epoch = isinstance(inner, (int, float)) or str(inner).lstrip('-').isdigit()
+    moment = pd.to_datetime(int(inner) if is_epoch else inner, unit='ms' if is_epoch else None, utc=True, errors='coerce')
+    return None if pd.isna(moment) else moment.strftime('%Y-%m-%d')
+
+def source_kind(source):
+    """Tipo de una fuente según su forma: 'sql' (URL con '://'), 'json' (.jsonl/.ndjson/.json, también comprimidos) o 'csv'."""
+    if '://' in source: return 'sql'
+    base_name = re.sub(r'\.(gz|bz2|zip|xz)$', '', source.lower())
+    return 'json' if base_name.endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+def read_source(source):
+    """Lee una fuente como texto: CSV (también .gz/.bz2/.zip/.xz), JSON lines (exportaciones de MongoDB) o SQL vía SQLAlchemy."""
+    kind = source_kind(source)
+    if kind == 'sql':
+        url, _, table_or_query = source.partition(SQL_SOURCE_SEPARATOR)
+        if not table_or_query: raise ValueError(f"Falta la tabla o consulta en '{source}' (formato: <url>{SQL_SOURCE_SEPARATOR}<tabla>).")
+        engine = get_sql_engine(url)
+        with engine.connect() as conn:
+            if table_or_query.lstrip().lower().startswith('select'): df = pd.read_sql_query(text(table_or_query), conn)
+            else: df = pd.read_sql_table(table_or_query, conn)
+        return _as_text(df)
+    if kind == 'json':
+        df = pd.read_json(source, lines=True, dtype=False)
+        for col in df.columns[df.dtypes == object]:
+            if df[col].map(type).eq(dict).any(): df[col] = df[col].map(_from_extended_json)
+        return _as_text(df.drop(columns=['_id'], errors='ignore')) # '_id' de MongoDB no forma parte del esquema
+    return pd.read_csv(source, dtype=str, delimiter=',')
+
+def _source_label(source):
+    """Nombre de la fuente para la columna `origen` (sin contraseña en las URLs SQL)."""
+    if '://' not in source: return source
+    url, _, table_or_query = source.partition(SQL_SOURCE_SEPARATOR)
+    from sqlalchemy.engine import make_url
+    return f"{make_url(url).render_as_string(hide_password=True)}{SQL_SOURCE_SEPARATOR}{table_or_query}"
+
+def _read_source_measured(source):
+    """Lectura de una fuente en un hilo del pool; devuelve `(df, error)` para informar desde el hilo principal."""
+    with measure_stage('extract_source', origen=_source_label(source)) as record:
+        try: df = read_source(source)
+        except Exception as e: return None, e
+        record['filas_salida'] = len(df)
+    return df, None
+
+@instrumented('extract_sources')
+def extract_sources(sources, max_workers=8):
+    """Extrae varias fuentes (rutas, patrones glob o URLs SQL) en paralelo con un pool de hilos acotado.
+
+    Cada fuente se lee como texto, normaliza sus cabeceras con `clean_column_names` y se etiqueta
+    en la columna `origen` (tipo `category`). Las filas se unen en el orden de las fuentes, así que
+    la deduplicación posterior conserva la primera aparición según ese orden.
+    """
+    sources = expand_sources(sources)
+    if not sources: print("Error: No hay fuentes que extraer."); return None
+    print(f"\nExtrayendo {len(sources)} fuentes con hasta {max_workers} hilos...")
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(sources)))) as executor:
+        results = list(executor.map(_read_source_measured, sources))
+    frames = []
+    for source, (df, error) in zip(sources, results): # Cabeceras, etiqueta y mensajes en el orden de las fuentes
+        if error is not None: print(f"Error al extraer {source}: {error}"); continue
+        df = clean_column_names(df)
+        df[SOURCE_COLUMN] = _source_label(source)
+        print(f"Fuente {_source_label(source)}: {len(df)} filas")
+        frames.append(df)
+    if not frames: print("Error: No se pudo extraer ninguna fuente."); return None
+    df = pd.concat(frames, ignore_index=True)
+    df[SOURCE_COLUMN] = pd.Categorical(df[SOURCE_COLUMN], categories=pd.unique(df[SOURCE_COLUMN]))
+    print(f"Datos extraídos de {len(frames)} fuentes. Número inicial de filas: {len(df)}")
+    return df
+
 # --- TRANSFORM ---
+def map_unique_values(series, func, dropna=True):
+    """Aplica `func` una sola vez por valor único de `series` y reconstruye el resultado por códigos.
+
+    `func` recibe y devuelve una Series alineada con los valores únicos. Con `dropna=True` los
+    nulos se mantienen nulos; con `dropna=False` el nulo se pasa a `func` como un valor más.
+    """
+    codes, uniques = pd.factorize(series, use_na_sentinel=dropna)
+    mapped = func(pd.Series(uniques, dtype=object))
+    values = pd.api.extensions.take(mapped.to_numpy(), codes, allow_fill=True)
+    return pd.Series(values, index=series.index, name=series.name)
+
+def map_categorical_values(series, func, dropna=False):
+    """Como `map_unique_values`, pero devuelve una Series de tipo `category`.
+
+    Si la entrada ya es categórica se transforman directamente sus categorías; varios valores
+    que terminan iguales se fusionan en una sola categoría.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        uniques = pd.Series(series.cat.categories, dtype=object)
+        if dropna is False and (codes == -1).any():
+            uniques = pd.concat([uniques, pd.Series([np.nan], dtype=object)], ignore_index=True)
+            codes = np.where(codes == -1, len(uniques) - 1, codes)
+    else:
+        codes, uniques = pd.factorize(series, use_na_sentinel=dropna)
+        uniques = pd.Series(uniques, dtype=object)
+    new_codes, categories = pd.factorize(func(uniques))
+    final_codes = np.where(codes == -1, -1, new_codes[codes]) if len(codes) else codes
+    return pd.Series(pd.Categorical.from_codes(final_codes, categories), index=series.index, name=series.name)
+
+@instrumented('clean_column_names')
 def clean_column_names(df):
     """Limpia los nombres de las columnas."""
     df.columns = df.columns.str.lower().str.strip().str.replace(' ', '_').str.replace('[^a-z0-9_]', '', regex=True)
-    print("\nNombres de columnas limpiados:")
-    print(df.columns)
+    if VERBOSE:
+        print("\nNombres de columnas limpiados:")
+        print(df.columns)
     return df
 
+@instrumented('clean_text_data')
 def clean_text_data(df, columns):
     """Limpia datos de texto (espacios, minúsculas iniciales)."""
     print(f"\nLimpiando columnas de texto: {columns}")
     for col in columns:
         if col in df.columns and df[col].dtype == 'object':
-            df[col] = df[col].str.strip().str.lower().str.replace(r'\s+', ' ', regex=True)
+            df[col] = map_unique_values(df[col], lambda values: values.str.strip().str.lower().str.replace(r'\s+', ' ', regex=True))
     return df
 
+@instrumented('handle_missing_values')
 def handle_missing_values(df):
     """Maneja valores faltantes."""
     print("\nManejando valores faltantes...")
     missing_markers = ['n/a', 'na', 'null', '', '--']
     for col in df.columns:
         if df[col].dtype == 'object':
-            df[col] = df[col].str.lower().replace(missing_markers, np.nan, regex=False)
-    print("Valores nulos por columna ANTES del tratamiento específico:")
-    print(df.isnull().sum())
+            df[col] = map_unique_values(df[col], lambda values: values.str.lower().replace(missing_markers, np.nan, regex=False))
+    if VERBOSE:
+        print("Valores nulos por columna ANTES del tratamiento específico:")
+        print(df.isnull().sum())
     if 'notas' in df.columns:
         df['notas'] = df['notas'].fillna('sin notas')
-    print("\nValores nulos por columna DESPUÉS del tratamiento inicial:")
-    print(df.isnull().sum())
+    if VERBOSE:
+        print("\nValores nulos por columna DESPUÉS del tratamiento inicial:")
+        print(df.isnull().sum())
     return df
 
+# Registro de formatos de fecha: (regex que identifica el formato, formato para pd.to_datetime).
+# El orden define la prioridad cuando un texto encaja con varios formatos.
+DATE_FORMATS = [
+    (r'\d{4}-\d{1,2}-\d{1,2}', '%Y-%m-%d'),
+    (r'\d{1,2}/\d{1,2}/\d{4}', '%d/%m/%Y'),
+    (r'\d{4}/\d{1,2}/\d{1,2}', '%Y/%m/%d'),
+    (r'[a-z]{3} \d{1,2}, \d{2}', '%b %d, %y'),
+    (r'[a-z]{3} \d{1,2} \d{4}', '%b %d %Y'),
+]
+
+def register_date_format(pattern, date_format, priority=None):
+    """Añade un formato al registro de fechas (al final, o en la posición `priority`)."""
+    entry = (pattern, date_format)
+    if priority is None: DATE_FORMATS.append(entry)
+    else: DATE_FORMATS.insert(priority, entry)
+
+def _parse_unique_dates(dates):
+    """Parsea textos de fecha únicos: clasifica cada uno por regex y convierte cada grupo en un solo lote."""
+    parsed = pd.Series(pd.NaT, index=dates.index, dtype='datetime64[ns]')
+    format_idx = np.full(len(dates), -1)
+    for i, (pattern, _) in enumerate(DATE_FORMATS):
+        unassigned = format_idx == -1
+        if not unassigned.any(): break
+        matches = dates[unassigned].str.fullmatch(pattern, case=False).fillna(False).to_numpy(dtype=bool)
+        format_idx[np.flatnonzero(unassigned)[matches]] = i
+    for i, (_, date_format) in enumerate(DATE_FORMATS):
+        group = format_idx == i
+        if group.any():
+            parsed[group] = pd.to_datetime(dates[group], format=date_format, errors='coerce')
+    # Los textos que ningún regex reconoce (espacios, variantes raras) pasan por la cascada completa
+    pending = parsed.isnull().to_numpy()
+    for _, date_format in DATE_FORMATS:
+        if not pending.any(): break
+        parsed[pending] = pd.to_datetime(dates[pending], format=date_format, errors='coerce')
+        pending = parsed.isnull().to_numpy()
+    return parsed
+
+def parse_dates(series):
+    """Convierte textos de fecha en múltiples formatos (ver `DATE_FORMATS`) a datetime.
+
+    Cada texto distinto se parsea una sola vez, así que el coste depende del número de
+    fechas únicas y no del número de filas.
+    """
+    return map_unique_values(series, _parse_unique_dates).astype('datetime64[ns]')
+
+@instrumented('convert_data_types')
 def convert_data_types(df):
     """Convierte columnas a los tipos de datos correctos."""
     print("\nConvirtiendo tipos de datos...")
     # --- Fechas ---
     if 'fecha' in df.columns:
         print("Intentando convertir fechas con múltiples formatos...")
-        original_dates = df['fecha'].copy()
-        df['fecha'] = pd.to_datetime(original_dates, format='%Y-%m-%d', errors='coerce')
-        mask = df['fecha'].isnull(); df.loc[mask, 'fecha'] = pd.to_datetime(original_dates[mask], format='%d/%m/%Y', errors='coerce')
-        mask = df['fecha'].isnull(); df.loc[mask, 'fecha'] = pd.to_datetime(original_dates[mask], format='%Y/%m/%d', errors='coerce')
-        mask = df['fecha'].isnull(); df.loc[mask, 'fecha'] = pd.to_datetime(original_dates[mask], format='%b %d, %y', errors='coerce')
-        mask = df['fecha'].isnull(); df.loc[mask, 'fecha'] = pd.to_datetime(original_dates[mask], format='%b %d %Y', errors='coerce')
-        print(f"Fechas convertidas. Nulos restantes en 'fecha': {df['fecha'].isnull().sum()}")
+        df['fecha'] = parse_dates(df['fecha'])
+        if VERBOSE: print(f"Fechas convertidas. Nulos restantes en 'fecha': {df['fecha'].isnull().sum()}")
     # --- Números (Cantidad) ---
     if 'cantidad' in df.columns:
         replacements = {'uno': '1', 'dos': '2'}
@@ -81,35 +350,98 @@ def convert_data_types(df):
     if 'precio_unitario' in df.columns:
         df['precio_unitario'] = df['precio_unitario'].astype(str).str.replace(r'[$, ]', '', regex=True)
         df['precio_unitario'] = pd.to_numeric(df['precio_unitario'], errors='coerce')
-    print("\nTipos de datos DESPUÉS de la conversión:")
-    df.info()
-    print("\nValores nulos DESPUÉS de la conversión:")
-    print(df.isnull().sum())
+    if VERBOSE:
+        print("\nTipos de datos DESPUÉS de la conversión:")
+        df.info()
+        print("\nValores nulos DESPUÉS de la conversión:")
+        print(df.isnull().sum())
     return df
 
-def standardize_categorical_data(df):
-    """Estandariza valores en columnas categóricas."""
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reglas_etl.json')
+_rules_cache = {}
+
+def load_normalization_rules(rules_file=RULES_FILE):
+    """Carga y compila las reglas de normalización categórica desde un JSON (sección 'categoricas').
+
+    Cada columna admite `plegar_acentos` (bool), `regex` (lista de [patrón, reemplazo]) y
+    `exactas` (dict valor -> valor). Se aplican en ese orden.
+    """
+    if rules_file in _rules_cache: return _rules_cache[rules_file]
+    try:
+        with open(rules_file, encoding='utf-8') as f: config = json.load(f)
+    except FileNotFoundError:
+        print(f"Advertencia: No se encontró el archivo de reglas {rules_file}. No se estandarizarán categorías.")
+        config = {}
+    rules = {}
+    for col, col_rules in config.get('categoricas', {}).items():
+        rules[col] = {
+            'fold_accents': col_rules.get('plegar_acentos', False),
+            'regex': [(re.compile(pattern), replacement) for pattern, replacement in col_rules.get('regex', [])],
+            'exact': col_rules.get('exactas', {}),
+        }
+    _rules_cache[rules_file] = rules
+    return rules
+
+def _apply_normalization_rules(values, col_rules):
+    """Aplica las reglas compiladas de una columna a una Series de valores únicos."""
+    values = values.astype(str)
+    if col_rules['fold_accents']:
+        values = values.str.normalize('NFKD').str.replace(r'[\u0300-\u036f]', '', regex=True).str.normalize('NFC')
+    for pattern, replacement in col_rules['regex']:
+        values = values.str.replace(pattern, replacement, regex=True)
+    if col_rules['exact']:
+        values = values.replace(col_rules['exact'])
+    return values
+
+@instrumented('standardize_categorical_data')
+def standardize_categorical_data(df, rules=None):
+    """Estandariza valores en columnas categóricas según las reglas de `reglas_etl.json`.
+
+    Las reglas se evalúan una vez por valor distinto y las columnas resultantes son de tipo `category`.
+    """
     print("\nEstandarizando datos categóricos...")
-    if 'descripcion_producto' in df.columns:
-        df['descripcion_producto'] = df['descripcion_producto'].astype(str)
-        replacements = {'laptop model x': 'laptop modelo x', 'teclado inalambrico': 'teclado inalámbrico', 'monitor 24"': 'monitor 24 pulgadas'}
-        df['descripcion_producto'] = df['descripcion_producto'].replace(replacements)
-        print("\nValores únicos en 'descripcion_producto':"); print(df['descripcion_producto'].unique())
-    if 'ciudad' in df.columns:
-        df['ciudad'] = df['ciudad'].astype(str)
-        city_replacements = { 'málaga': 'malaga' }
-        df['ciudad'] = df['ciudad'].replace(city_replacements)
-        print("\nValores únicos en 'ciudad':"); print(df['ciudad'].unique())
+    rules = load_normalization_rules() if rules is None else rules
+    for col, col_rules in rules.items():
+        if col in df.columns:
+            df[col] = map_categorical_values(df[col], lambda values: _apply_normalization_rules(values, col_rules))
+            if VERBOSE: print(f"\nValores únicos en '{col}':"); print(df[col].unique().tolist())
     return df
 
-def remove_duplicates(df):
-    """Elimina filas duplicadas basado en id_transaccion."""
+def hash_ids(ids):
+    """Hash de 64 bits de cada id: 8 bytes por id para recordar los ya vistos (en lugar de un set de textos)."""
+    return pd.util.hash_pandas_object(ids, index=False).to_numpy()
+
+def find_sorted(known, hashes):
+    """Búsqueda binaria vectorizada de `hashes` en el array ordenado `known`: devuelve `(posiciones, encontrados)`."""
+    if not len(known): return np.zeros(len(hashes), dtype=np.intp), np.zeros(len(hashes), dtype=bool)
+    order = np.argsort(hashes) # Buscar en orden recorre `known` secuencialmente (mucho mejor uso de caché)
+    pos = np.empty(len(hashes), dtype=np.intp)
+    pos[order] = np.minimum(np.searchsorted(known, hashes[order]), len(known) - 1)
+    return pos, known[pos] == hashes
+
+@instrumented('remove_duplicates')
+def remove_duplicates(df, seen_ids=None):
+    """Elimina filas duplicadas basado en id_transaccion.
+
+    Si se pasa `seen_ids` (dict con 'id_hashes', array ordenado de hashes uint64 como en el estado
+    incremental), también descarta los ids ya vistos en bloques anteriores y añade los nuevos
+    (deduplicación entre bloques con memoria de 8 bytes por id).
+    """
     print("\nBuscando y eliminando duplicados...")
     initial_rows = len(df)
     subset_cols = ['id_transaccion']
     if all(col in df.columns for col in subset_cols):
         print(f"Eliminando duplicados basados en: {subset_cols}, manteniendo la primera.")
         df.drop_duplicates(subset=subset_cols, keep='first', inplace=True)
+        if seen_ids is not None:
+            hashes = hash_ids(df['id_transaccion'])
+            _, already_seen = find_sorted(seen_ids['id_hashes'], hashes)
+            if already_seen.any():
+                print(f"Descartando {already_seen.sum()} filas con ids vistos en bloques anteriores.")
+                df = df[~already_seen].copy()
+            merged = np.concatenate([seen_ids['id_hashes'], np.sort(hashes[~already_seen])])
+            merged.sort(kind='stable') # Dos tramos ya ordenados: la ordenación estable los fusiona en tiempo lineal
+            seen_ids['id_hashes'] = merged
     else:
         print(f"Advertencia: Columna {subset_cols} no encontrada. Eliminando duplicados exactos.")
         df.drop_duplicates(inplace=True)
@@ -117,106 +449,570 @@ def remove_duplicates(df):
     print(f"Se eliminaron {rows_removed} filas duplicadas.")
     return df
 
-def apply_transformations(df):
-    """Aplica toda la secuencia de transformaciones."""
-    if df is None: return None
-    df = clean_column_names(df)
-    text_cols = [col for col in ['nombre_cliente', 'producto_id', 'descripcion_producto', 'ciudad', 'region', 'notas'] if col in df.columns]
-    df = clean_text_data(df, text_cols)
-    df = handle_missing_values(df)
-    df = convert_data_types(df)
-    # --- Manejo de Nulos Críticos POST-Conversión ---
-    cols_to_check_for_nan = ['fecha', 'cantidad', 'precio_unitario', 'id_transaccion']
-    cols_to_check_for_nan = [col for col in cols_to_check_for_nan if col in df.columns]
-    if cols_to_check_for_nan:
-        initial_rows = len(df); print(f"\nFilas ANTES de dropna crítico: {initial_rows}"); print(f"Nulos ANTES:\n{df[cols_to_check_for_nan].isnull().sum()}")
-        df.dropna(subset=cols_to_check_for_nan, inplace=True)
-        print(f"Filas DESPUÉS de dropna crítico: {len(df)}"); print(f"Se eliminaron {initial_rows - len(df)} filas con nulos críticos.")
-    else: print("\nAdvertencia: No se encontraron columnas críticas para dropna.")
-    # --- Conversión Final de Tipos ---
+# --- VALIDACIÓN (reglas declarativas y cuarentena) ---
+VALIDATION_PHASES = ('filas', 'final') # 'filas': antes de deduplicar; 'final': después de deduplicar
+# Reglas por defecto (si reglas_etl.json no tiene sección 'validacion'): nulos críticos y precio no positivo
+DEFAULT_VALIDATION_RULES = [
+    {'nombre': 'fecha_nula', 'tipo': 'no_nulo', 'columna': 'fecha'},
+    {'nombre': 'cantidad_nula', 'tipo': 'no_nulo', 'columna': 'cantidad'},
+    {'nombre': 'precio_nulo', 'tipo': 'no_nulo', 'columna': 'precio_unitario'},
+    {'nombre': 'id_nulo', 'tipo': 'no_nulo', 'columna': 'id_transaccion'},
+    {'nombre': 'precio_no_positivo', 'tipo': 'rango', 'columna': 'precio_unitario', 'min': 0, 'incluir_min': False, 'fase': 'final'},
+]
+CONVERTED_COLUMNS = ['fecha', 'cantidad', 'precio_unitario'] # En cuarentena se guarda también su valor antes de convertir
+QUARANTINE_COLUMNS = ['motivo_codigo', 'motivos', 'fase_validacion']
+_validation_cache = {}
+
+def load_validation_rules(rules_file=RULES_FILE):
+    """Carga las reglas de validación (sección 'validacion' de `reglas_etl.json`); cada regla ocupa un bit del código de motivo.
+
+    Tipos: `no_nulo`; `rango` (`min`/`max`, `incluir_min`/`incluir_max`); `regex` (`patron`, coincidencia
+    completa); `referencia` (`valores` o `archivo` CSV con la columna `columna_referencia`).
+    `fase` es 'filas' (por defecto, antes de deduplicar) o 'final' (después). Las reglas con `"activa": false`
+    se ignoran (conservan su bit, para que los códigos de motivo no cambien al activarlas).
+    """
+    if rules_file in _validation_cache: return _validation_cache[rules_file]
+    try:
+        with open(rules_file, encoding='utf-8') as f: config = json.load(f).get('validacion', {})
+    except FileNotFoundError:
+        config = {}
+    rules = []
+    for bit, rule in enumerate(config.get('reglas', DEFAULT_VALIDATION_RULES)):
+        if bit >= 63: raise ValueError("Se admiten como máximo 63 reglas de validación.")
+        rule = {'fase': 'filas', **rule, 'bit': bit}
+        if not rule.get('activa', True): continue
+        if rule['fase'] not in VALIDATION_PHASES: raise ValueError(f"Fase de validación desconocida en '{rule['nombre']}': {rule['fase']}")
+        if rule['tipo'] == 'regex':
+            rule['patron'] = re.compile(rule['patron'])
+        elif rule['tipo'] == 'referencia':
+            values = rule.get('valores')
+            if values is None:
+                reference_col = rule.get('columna_referencia', rule['columna'])
+                values = pd.read_csv(os.path.join(os.path.dirname(rules_file), rule['archivo']), dtype=str, usecols=[reference_col])[reference_col].dropna()
+            rule['valores'] = pd.Index(pd.unique(pd.Series(values, dtype=object)))
+        elif rule['tipo'] not in ('no_nulo', 'rango'):
+            raise ValueError(f"Tipo de regla de validación desconocido en '{rule['nombre']}': {rule['tipo']}")
+        rules.append(rule)
+    _validation_cache[rules_file] = rules
+    return rules
+
+def _regex_fullmatch(values, pattern):
+    """Coincidencia completa de `pattern` (compilado) sobre un índice de textos, con el motor RE2 vectorizado de pyarrow si está disponible."""
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        matches = pc.match_substring_regex(pa.array(values, type=pa.string()), f'^(?:{pattern.pattern})$')
+        return matches.to_numpy(zero_copy_only=False).astype(bool)
+    except Exception: # Sin pyarrow o patrón no admitido por RE2 (p. ej. referencias hacia atrás): motor `re`
+        return np.asarray(values.str.fullmatch(pattern), dtype=bool)
+
+def _rule_failures(series, rule):
+    """Máscara de filas que incumplen una regla. Los nulos solo los rechaza `no_nulo`; regex y
+    referencias se evalúan una vez por valor distinto y se expanden por códigos."""
+    if rule['tipo'] == 'no_nulo': return series.isna().to_numpy()
+    present = series.notna().to_numpy()
+    if rule['tipo'] == 'rango':
+        as_bound = pd.Timestamp if pd.api.types.is_datetime64_any_dtype(series.dtype) else (lambda value: value)
+        valid = np.ones(len(series), dtype=bool)
+        if rule.get('min') is not None:
+            valid &= (series >= as_bound(rule['min']) if rule.get('incluir_min', True) else series > as_bound(rule['min'])).to_numpy()
+        if rule.get('max') is not None:
+            valid &= (series <= as_bound(rule['max']) if rule.get('incluir_max', True) else series < as_bound(rule['max'])).to_numpy()
+        return present & ~valid
+    codes, uniques = pd.factorize(series)
+    if len(uniques) == 0: return np.zeros(len(series), dtype=bool)
+    uniques = pd.Index(np.asarray(uniques, dtype=object))
+    if rule['tipo'] == 'regex': valid_uniques = _regex_fullmatch(uniques.astype(str), rule['patron'])
+    else: valid_uniques = uniques.isin(rule['valores'])
+    return present & ~valid_uniques[codes] # codes == -1 (nulo) queda anulado por `present`
+
+def _quarantine_rows(df, failed, reason_codes, rules, phase, originals=None):
+    """Filas rechazadas con su código de motivo (bitmask), los nombres de las reglas incumplidas y los valores originales."""
+    quarantined = df[failed].copy()
+    codes = reason_codes[failed]
+    unique_codes, inverse = np.unique(codes, return_inverse=True) # Pocas combinaciones distintas: se decodifican una vez
+    names = np.array([', '.join(rule['nombre'] for rule in rules if code >> rule['bit'] & 1) for code in unique_codes], dtype=object)
+    quarantined['motivo_codigo'], quarantined['motivos'], quarantined['fase_validacion'] = codes, names[inverse], phase
+    for col in CONVERTED_COLUMNS: # Columnas fijas para que las cuarentenas de distintas fases/bloques tengan el mismo esquema
+        quarantined[f'{col}_original'] = originals[col].to_numpy()[failed] if originals and col in originals else np.nan
+    return quarantined
+
+def validate_rows(df, phase, originals=None, rules=None):
+    """Evalúa en una pasada vectorizada las reglas de `phase` y separa las filas rechazadas.
+
+    Devuelve `(df_valido, df_rechazado o None, conteo por regla)`. Los conteos se emiten como
+    métricas de la etapa `validacion:<fase>`.
+    """
+    rules = load_validation_rules() if rules is None else rules
+    rules = [rule for rule in rules if rule['fase'] == phase and rule['columna'] in df.columns]
+    with measure_stage(f'validacion:{phase}', rows_in=len(df)) as record:
+        reason_codes = np.zeros(len(df), dtype=np.int64)
+        for rule in rules:
+            reason_codes |= _rule_failures(df[rule['columna']], rule).astype(np.int64) << rule['bit']
+        failed = reason_codes != 0
+        counts = {rule['nombre']: int(np.count_nonzero(reason_codes >> rule['bit'] & 1)) for rule in rules}
+        quarantined = None
+        if failed.any():
+            quarantined = _quarantine_rows(df, failed, reason_codes, rules, phase, originals)
+            df = df[~failed].copy()
+        record.update({'filas_salida': len(df), 'filas_rechazadas': int(failed.sum()), 'rechazos': counts})
+    return df, quarantined, counts
+
+def build_quarantine(rejected):
+    """Une las filas rechazadas acumuladas en `rejected` (con Title Case, como la salida limpia); None si no hay."""
+    frames = [part for part in rejected if part is not None and not part.empty]
+    if not frames: return None
+    return apply_title_case(pd.concat(frames, ignore_index=True))
+
+def write_quarantine(rejected, target, if_exists='replace'):
+    """Escribe las filas rechazadas en el destino de cuarentena `(formato, kwargs)` de `load_data`."""
+    quarantine_df = build_quarantine(rejected)
+    target_format, target_kwargs = target
+    if quarantine_df is None:
+        print("\nNo hay filas rechazadas para la cuarentena.")
+        stale_file = target_kwargs.get('file_path')
+        if if_exists == 'replace' and target_format == 'csv' and stale_file and os.path.exists(stale_file): os.remove(stale_file) # Evitar una cuarentena de una ejecución anterior
+        return
+    summary = quarantine_df['motivos'].value_counts().to_dict()
+    print(f"\nCuarentena: {len(quarantine_df)} filas rechazadas {summary}")
+    load_data(quarantine_df, target_format=target_format, if_exists=if_exists, **target_kwargs)
+
+@instrumented('drop_critical_nulls')
+def drop_critical_nulls(df, rejected=None, originals=None):
+    """Elimina las filas que incumplen las reglas de la fase 'filas' (por defecto, nulos en columnas críticas).
+
+    Si se pasa `rejected` (lista), se le añaden las filas eliminadas con sus motivos.
+    """
+    initial_rows = len(df); print(f"\nFilas ANTES de la validación: {initial_rows}")
+    df, quarantined, counts = validate_rows(df, 'filas', originals=originals)
+    if not counts: print("\nAdvertencia: Ninguna regla de validación aplica a las columnas disponibles.")
+    if VERBOSE: print(f"Rechazos por regla: {counts}")
+    if quarantined is not None and rejected is not None: rejected.append(quarantined)
+    print(f"Filas DESPUÉS de la validación: {len(df)}"); print(f"Se eliminaron {initial_rows - len(df)} filas inválidas (nulos críticos u otras reglas).")
+    return df
+
+def cast_final_types(df):
+    """Convierte 'cantidad' a entero si ya no quedan nulos."""
     if 'cantidad' in df.columns and df['cantidad'].isnull().sum() == 0:
          try: df['cantidad'] = df['cantidad'].astype(int)
          except ValueError as e: print(f"Advertencia: 'cantidad' no se pudo convertir a entero: {e}")
-    df = standardize_categorical_data(df)
-    df = remove_duplicates(df)
-    # Validación final
-    if 'precio_unitario' in df.columns:
-        invalid_prices = df[df['precio_unitario'] <= 0]
-        if not invalid_prices.empty: print("\nALERTA: Precios no positivos:"); print(invalid_prices); df = df[df['precio_unitario'] > 0]
+    return df
 
-    # --- Aplicar Title Case ---
+@instrumented('filter_invalid_prices')
+def filter_invalid_prices(df, rejected=None):
+    """Descarta las filas que incumplen las reglas de la fase 'final' (por defecto, precio unitario no positivo)."""
+    df, quarantined, counts = validate_rows(df, 'final')
+    if quarantined is not None:
+        print(f"\nALERTA: {len(quarantined)} filas rechazadas tras deduplicar: { {name: n for name, n in counts.items() if n} }")
+        if VERBOSE: print(quarantined)
+        if rejected is not None: rejected.append(quarantined)
+    return df
+
+TITLE_CASE_COLUMNS = ['nombre_cliente', 'descripcion_producto', 'ciudad', 'region', 'notas'] # Nulos -> '' ('Sin Notas' en notas)
+
+@instrumented('apply_title_case')
+def apply_title_case(df):
+    """Aplica formato Title Case a las columnas de texto."""
     print("\nAplicando formato Title Case a columnas de texto...")
-    title_case_cols = ['nombre_cliente', 'descripcion_producto', 'ciudad', 'region', 'notas']
-    for col in title_case_cols:
+    for col in TITLE_CASE_COLUMNS:
         if col in df.columns:
-            df[col] = df[col].astype(str).str.title().replace('Nan', 'Sin Notas' if col == 'notas' else '')
-    # --- Fin Title Case ---
+            empty_value = 'Sin Notas' if col == 'notas' else ''
+            to_title = lambda values: values.astype(str).str.title().replace('Nan', empty_value)
+            if isinstance(df[col].dtype, pd.CategoricalDtype): df[col] = map_categorical_values(df[col], to_title)
+            else: df[col] = map_unique_values(df[col], to_title, dropna=False)
+    return df
 
+def transform_rows(df, rejected=None):
+    """Aplica los pasos que solo dependen de cada fila (todo salvo deduplicación y filtro de precios)."""
+    df = clean_column_names(df)
+    text_cols = [col for col in ['nombre_cliente', 'producto_id', 'descripcion_producto', 'ciudad', 'region', 'notas'] if col in df.columns]
+    df = clean_text_data(df, text_cols)
+    df = handle_missing_values(df)
+    # Referencias a las columnas antes de convertir (sin copia) para guardar el valor original de las filas en cuarentena
+    originals = {col: df[col] for col in CONVERTED_COLUMNS if col in df.columns} if rejected is not None else None
+    df = convert_data_types(df)
+    df = drop_critical_nulls(df, rejected=rejected, originals=originals)
+    df = cast_final_types(df)
+    df = standardize_categorical_data(df)
+    return df
+
+def _print_transformation_summary(df):
     print("\n--- Transformación Completa ---")
-    print("Primeras filas de datos limpios (con Title Case):")
-    print(df.head())
-    print("\nTipos de datos finales:")
-    df.info()
+    if VERBOSE:
+        print("Primeras filas de datos limpios (con Title Case):")
+        print(df.head())
+        print("\nTipos de datos finales:")
+        df.info()
     print(f"Número final de filas: {len(df)}")
+
+@instrumented('apply_transformations')
+def apply_transformations(df, seen_ids=None, rejected=None):
+    """Aplica toda la secuencia de transformaciones.
+
+    `seen_ids` se usa en modo streaming para deduplicar entre bloques (ver `remove_duplicates`).
+    Si se pasa `rejected` (lista), recibe las filas descartadas por la validación (ver `build_quarantine`).
+    """
+    if df is None: return None
+    df = transform_rows(df, rejected=rejected)
+    df = remove_duplicates(df, seen_ids=seen_ids)
+    # Validación final
+    df = filter_invalid_prices(df, rejected=rejected)
+    df = apply_title_case(df)
+    _print_transformation_summary(df)
     return df
 
+def _transform_partition(df, collect_rejected=False):
+    """Paso por partición del modo paralelo (se ejecuta en un proceso trabajador); devuelve también sus filas rechazadas."""
+    rejected = [] if collect_rejected else None
+    return apply_title_case(transform_rows(df, rejected=rejected)), rejected
+
+def _concat_partitions(parts):
+    """Une particiones transformadas conservando el tipo `category` (unificando categorías)."""
+    for col in parts[0].columns:
+        if isinstance(parts[0][col].dtype, pd.CategoricalDtype):
+            categories = pd.Index(pd.unique(np.concatenate([part[col].cat.categories.to_numpy(dtype=object) for part in parts])))
+            for part in parts: part[col] = part[col].cat.set_categories(categories)
+    return pd.concat(parts)
+
+@instrumented('apply_transformations_parallel')
+def apply_transformations_parallel(df, n_workers=None, rejected=None):
+    """Igual que `apply_transformations`, pero reparte los pasos por fila en un pool de procesos.
+
+    El DataFrame crudo se divide en `n_workers` particiones contiguas; cada proceso aplica
+    `transform_rows` y el Title Case, y después se unen en el orden original y se aplican una
+    sola vez los pasos globales (deduplicación y filtro de precios). El resultado es idéntico
+    al de la ruta secuencial.
+    """
+    if df is None: return None
+    n_workers = n_workers or os.cpu_count() or 1
+    n_partitions = max(1, min(n_workers, len(df)))
+    bounds = np.linspace(0, len(df), n_partitions + 1, dtype=int)
+    partitions = [df.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+    print(f"\nTransformando {len(df)} filas en {n_partitions} particiones con {n_workers} procesos...")
+    # Los procesos trabajadores heredan la configuración de diagnósticos/métricas (también con 'spawn')
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=configure_instrumentation, initargs=(VERBOSE, METRICS_FILE)) as executor:
+        results = list(executor.map(functools.partial(_transform_partition, collect_rejected=rejected is not None), partitions))
+    if rejected is not None:
+        for _, part_rejected in results: rejected.extend(part_rejected)
+    # Las particiones vacías pueden tener otros dtypes; se omiten al unir
+    parts = [part for part, _ in results]
+    non_empty = [part for part in parts if not part.empty] or parts[:1]
+    df = _concat_partitions(non_empty)
+    df = cast_final_types(df)
+    df = remove_duplicates(df)
+    df = filter_invalid_prices(df, rejected=rejected)
+    _print_transformation_summary(df)
+    return df
+
+
+# --- AGREGADOS (Rollups para el dashboard) ---
+ROLLUP_DIMENSIONS = ['fecha', 'ciudad', 'region', 'descripcion_producto']
+ROLLUP_MEASURES = ['ingresos', 'cantidad', 'transacciones']
+# Nombre del rollup -> dimensiones por las que se agrega ('mes' = fecha truncada a fin de mes)
+ROLLUPS = {
+    'por_ciudad': ['ciudad'],
+    'por_producto': ['descripcion_producto'],
+    'por_dia': ['fecha'],
+    'por_mes': ['mes'],
+    'ciudad_producto': ['ciudad', 'descripcion_producto'],
+    'ciudad_mes': ['ciudad', 'mes'],
+    'producto_mes': ['descripcion_producto', 'mes'],
+}
+
+def build_rollup_cube(df):
+    """Agrega los datos limpios al grano (día, ciudad, región, producto): ingresos, cantidad y nº de transacciones.
+
+    Es el agregado más fino; el resto de rollups se derivan de él y varios cubos parciales
+    (p. ej. de bloques en modo streaming) se combinan con `combine_rollup_cubes`.
+    """
+    dimensions = [col for col in ROLLUP_DIMENSIONS if col in df.columns]
+    measures = pd.DataFrame({col: df[col] for col in dimensions})
+    measures['fecha'] = df['fecha'].dt.normalize()
+    measures['ingresos'] = df['cantidad'] * df['precio_unitario']
+    measures['cantidad'] = df['cantidad']
+    measures['transacciones'] = 1
+    return measures.groupby(dimensions, observed=True, sort=False, dropna=False)[ROLLUP_MEASURES].sum().reset_index()
+
+def combine_rollup_cubes(cubes):
+    """Une cubos parciales re-agregando sus medidas."""
+    cubes = [cube.astype({col: 'category' for col in ROLLUP_DIMENSIONS[1:] if col in cube.columns}) for cube in cubes]
+    cube = _concat_partitions(cubes).reset_index(drop=True) # Conserva las dimensiones como 'category'
+    dimensions = [col for col in ROLLUP_DIMENSIONS if col in cube.columns]
+    return cube.groupby(dimensions, observed=True, sort=False, dropna=False)[ROLLUP_MEASURES].sum().reset_index()
+
+def build_rollups(cube):
+    """Deriva todos los rollups (ver `ROLLUPS`) y un resumen general a partir del cubo."""
+    cube = cube.assign(mes=cube['fecha'] + pd.offsets.MonthEnd(0))
+    rollups = {'cubo': cube.drop(columns=['mes'])}
+    for name, dimensions in ROLLUPS.items():
+        if all(col in cube.columns for col in dimensions):
+            rollups[name] = cube.groupby(dimensions, observed=True, dropna=False)[ROLLUP_MEASURES].sum().reset_index()
+    rollups['resumen'] = pd.DataFrame({
+        'transacciones': [cube['transacciones'].sum()], 'ingresos': [cube['ingresos'].sum()],
+        'cantidad': [cube['cantidad'].sum()], 'fecha_min': [cube['fecha'].min()], 'fecha_max': [cube['fecha'].max()],
+    })
+    return rollups
+
+def save_rollups(rollups, dir_path='rollups'):
+    """Guarda cada rollup como `<dir_path>/<nombre>.parquet` (reemplazando los anteriores)."""
+    os.makedirs(dir_path, exist_ok=True)
+    for name, rollup in rollups.items():
+        rollup.to_parquet(os.path.join(dir_path, f'{name}.parquet'), index=False)
+    print(f"Rollups guardados en {dir_path}: {', '.join(f'{name} ({len(r)} filas)' for name, r in rollups.items())}")
 
 # --- LOAD ---
-def load_data(df, target_format='csv', **kwargs):
-    """Carga los datos transformados con formato mejorado para Excel y cabeceras."""
+DEFAULT_BATCH_SIZE = 10_000
+_sql_engines = {}
+_mongo_clients = {}
+
+def get_sql_engine(connection_string):
+    """Devuelve un engine SQLAlchemy (con su pool de conexiones) reutilizado entre llamadas."""
+    if connection_string not in _sql_engines:
+        _sql_engines[connection_string] = create_engine(connection_string)
+    return _sql_engines[connection_string]
+
+def get_mongo_client(connection_string):
+    """Devuelve un MongoClient reutilizado entre llamadas (verifica la conexión al crearlo)."""
+    if connection_string not in _mongo_clients:
+        from pymongo import MongoClient
+        client = MongoClient(connection_string, serverSelectionTimeoutMS=5000)
+        client.admin.command('ping') # Verificar conexión
+        _mongo_clients[connection_string] = client
+    return _mongo_clients[connection_string]
+
+def close_connections():
+    """Cierra los engines SQL y clientes MongoDB abiertos por `load_data`."""
+    for engine in _sql_engines.values(): engine.dispose()
+    for client in _mongo_clients.values(): client.close()
+    _sql_engines.clear(); _mongo_clients.clear()
+
+def _postgres_copy_insert(table, conn, keys, data_iter):
+    """Método de inserción para `to_sql` que usa COPY ... FROM STDIN en PostgreSQL."""
+    dbapi_conn = conn.connection
+    with dbapi_conn.cursor() as cursor:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(data_iter)
+        buffer.seek(0)
+        columns = ', '.join(f'"{k}"' for k in keys)
+        table_name = f'"{table.schema}"."{table.name}"' if table.schema else f'"{table.name}"'
+        cursor.copy_expert(f'COPY {table_name} ({columns}) FROM STDIN WITH CSV', buffer)
+
+def _sql_insert_method(engine):
+    """Elige la inserción masiva según el motor: COPY en PostgreSQL, executemany en SQLite
+    (límite bajo de parámetros por sentencia) e INSERT multi-fila en el resto."""
+    if engine.dialect.name == 'postgresql' and engine.dialect.driver == 'psycopg2': return _postgres_copy_insert
+    if engine.dialect.name == 'sqlite': return None
+    return 'multi'
+
+# Máximo de parámetros enlazados por sentencia (un INSERT multi-fila usa filas × columnas)
+SQL_MAX_BIND_PARAMS = {'postgresql': 65_535, 'mssql': 2_100, 'mysql': 65_535, 'mariadb': 65_535, 'oracle': 65_535}
+DEFAULT_MAX_BIND_PARAMS = 32_766
+
+def _sql_batch_size(engine, insert_method, batch_size, n_columns):
+    """Limita las filas por sentencia de un INSERT multi-fila para no superar los parámetros admitidos por el motor."""
+    if insert_method != 'multi': return batch_size
+    max_params = SQL_MAX_BIND_PARAMS.get(engine.dialect.name, DEFAULT_MAX_BIND_PARAMS) - 1
+    return max(1, min(batch_size, max_params // max(n_columns, 1)))
+
+def _create_key_index(connection, table, key):
+    """Crea el índice sobre la clave de upsert si no existe, con el DDL propio de cada motor."""
+    Index(f"ix_{table.name}_{key}", table.c[key]).create(connection, checkfirst=True)
+
+def _throughput(n_rows, start):
+    elapsed = time.perf_counter() - start
+    return f"{n_rows} filas en {elapsed:.2f}s ({n_rows / elapsed if elapsed > 0 else float('inf'):,.0f} filas/s)"
+
+EXCEL_MAX_ROWS = 1_048_576 # Límite de filas por hoja (incluida la cabecera)
+EXCEL_EPOCH = pd.Timestamp('1899-12-30') # Día 0 de las fechas seriales de Excel
+EXCEL_WRITE_BLOCK = 10_000 # Filas convertidas a valores de Python a la vez (no la hoja entera)
+
+def _excel_column_widths(df, headers, sample_size=10_000):
+    """Ancho de cada columna: longitud máxima en las categorías o en una muestra de filas (no en toda la columna)."""
+    sample = df.sample(n=sample_size, random_state=0) if len(df) > sample_size else df
+    widths = []
+    for col, header in zip(df.columns, headers):
+        series = df[col]
+        if pd.api.types.is_datetime64_any_dtype(series.dtype): max_len = 10 # yyyy-mm-dd
+        elif isinstance(series.dtype, pd.CategoricalDtype): max_len = series.cat.categories.astype(str).str.len().max()
+        else: max_len = sample[col].dropna().astype(str).str.len().max()
+        widths.append(max(int(max_len) if pd.notna(max_len) else 0, len(header)) + 3)
+    return [max(width, 12) for width in widths]
+
+def _excel_cell_values(series):
+    """Valores nativos de Python para xlsxwriter (fechas como número serial, nulos como None = celda vacía)."""
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        series = (series - EXCEL_EPOCH) / pd.Timedelta(days=1)
+    values = series.astype(object)
+    return values.where(series.notna(), None).tolist()
+
+def _write_excel(df, file_path, sheet_name, max_rows=EXCEL_MAX_ROWS):
+    """Escribe `df` con xlsxwriter en modo constant_memory (filas en streaming), repartiendo en varias hojas si supera `max_rows`."""
+    # nan_inf_to_errors: ±inf se escribe como error #NUM! en lugar de abortar la exportación
+    workbook = xlsxwriter.Workbook(file_path, {'constant_memory': True, 'nan_inf_to_errors': True})
+    header_format = workbook.add_format({'bold': True, 'text_wrap': False, 'valign': 'vcenter', 'align': 'center', 'fg_color': '#DDEBF7', 'border': 1})
+    currency_format = workbook.add_format({'num_format': '#,##0.00 €'})
+    date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+    integer_format = workbook.add_format({'num_format': '0'})
+    headers = [col.replace('_', ' ').title() for col in df.columns] # Cabeceras transformadas
+    widths = _excel_column_widths(df, headers)
+    col_formats = [date_format if pd.api.types.is_datetime64_any_dtype(df[col].dtype) else currency_format if col == 'precio_unitario'
+                   else integer_format if col == 'cantidad' else None for col in df.columns]
+
+    rows_per_sheet = max_rows - 1
+    for sheet_num, start in enumerate(range(0, max(len(df), 1), rows_per_sheet), start=1):
+        name = sheet_name if sheet_num == 1 else f"{sheet_name[:26]} ({sheet_num})" # Máximo 31 caracteres
+        worksheet = workbook.add_worksheet(name)
+        # Formato de columna antes de escribir filas: en constant_memory cada fila se vuelca al pasar a la siguiente
+        for idx, (width, col_format) in enumerate(zip(widths, col_formats)):
+            worksheet.set_column(idx, idx, width, col_format)
+        worksheet.write_row(0, 0, headers, header_format)
+        sheet_end = min(start + rows_per_sheet, len(df))
+        for block_start in range(start, sheet_end, EXCEL_WRITE_BLOCK):
+            block = df.iloc[block_start:min(block_start + EXCEL_WRITE_BLOCK, sheet_end)]
+            columns = [_excel_cell_values(block[col]) for col in block.columns]
+            for row_num, row in enumerate(zip(*columns), start=block_start - start + 1):
+                worksheet.write_row(row_num, 0, row)
+        if len(df) > rows_per_sheet: print(f"Hoja '{name}': {sheet_end - start} filas.")
+    workbook.close()
+
+def read_parquet_rows(dir_path, keys, key='id_transaccion', columns=None):
+    """Filas del dataset Parquet cuya `key` está en `keys`, leídas con filtro (None si no hay ninguna)."""
+    if not len(keys) or not os.path.isdir(dir_path): return None
+    rows = pd.read_parquet(dir_path, columns=columns, filters=[(key, 'in', list(keys))])
+    return rows.drop(columns=['mes'], errors='ignore') if columns is None and len(rows) else rows if len(rows) else None
+
+def _upsert_parquet_partitions(df, dir_path, key='id_transaccion', changed_keys=None):
+    """Upsert en el dataset particionado por mes: solo se reescriben las particiones `mes=` con filas nuevas
+    o sustituidas. Con `changed_keys=None` se buscan en el dataset todas las claves de `df`."""
+    months = df['fecha'].dt.strftime('%Y-%m')
+    removed_keys = df[key].astype(str).tolist() if changed_keys is None else list(changed_keys)
+    located = read_parquet_rows(dir_path, removed_keys, key, columns=[key, 'mes'])
+    affected = sorted(set(months) | (set(located['mes'].astype(str)) if located is not None else set()))
+    categorical = {col: 'category' for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)}
+    for month in affected:
+        partition_dir = os.path.join(dir_path, f'mes={month}')
+        tmp_dir = os.path.join(dir_path, f'.tmp_mes={month}') # Los lectores de Parquet ignoran los nombres con '.'
+        parts = [pd.read_parquet(partition_dir)] if os.path.isdir(partition_dir) else []
+        if parts and removed_keys: parts[0] = parts[0][~parts[0][key].isin(removed_keys)]
+        partition = pd.concat(parts + [df[months == month]], ignore_index=True).astype(categorical)
+        partition.sort_values(by='fecha', inplace=True, kind='stable')
+        shutil.rmtree(tmp_dir, ignore_errors=True); os.makedirs(tmp_dir)
+        partition.to_parquet(os.path.join(tmp_dir, 'part-0.parquet'), index=False)
+        shutil.rmtree(partition_dir, ignore_errors=True)
+        if len(partition): os.replace(tmp_dir, partition_dir)
+        else: shutil.rmtree(tmp_dir)
+    print(f"Particiones reescritas en {dir_path}: {', '.join(f'mes={month}' for month in affected)}")
+
+@instrumented(lambda df, target_format='csv', *args, **kwargs: f"load_data:{target_format}")
+def load_data(df, target_format='csv', if_exists='replace', **kwargs):
+    """Carga los datos transformados con formato mejorado para Excel y cabeceras.
+
+    `if_exists='append'` añade a un destino existente (CSV, SQL, MongoDB) en lugar de reemplazarlo.
+    `if_exists='upsert'` inserta o actualiza filas por la clave `key` (por defecto 'id_transaccion');
+    en CSV y Parquet, `changed_keys` (lista de claves ya existentes) evita buscar en el destino cuando solo hay
+    filas nuevas. En rollups, el upsert suma el delta al cubo guardado y resta `replaced_rows` (filas sustituidas).
+    """
     if df is None or df.empty: print("\nAdvertencia: No hay datos limpios para cargar."); return
     print(f"\nCargando datos en formato: {target_format.upper()}")
     try:
         if target_format == 'csv':
             file_path = kwargs.get('file_path', 'datos_limpios.csv')
-            df.to_csv(file_path, index=False, encoding='utf-8-sig')
+            if if_exists == 'upsert' and os.path.exists(file_path):
+                key = kwargs.get('key', 'id_transaccion'); changed_keys = kwargs.get('changed_keys')
+                if changed_keys is None or len(changed_keys): # Sin claves modificadas basta con añadir al final
+                    existing = pd.read_csv(file_path, dtype=str, encoding='utf-8-sig')
+                    replaced = existing[key].isin(df[key].astype(str) if changed_keys is None else changed_keys)
+                    if replaced.any(): # Solo se reescribe el archivo si hay filas que actualizar
+                        print(f"Actualizando {replaced.sum()} filas existentes en {file_path}.")
+                        existing[~replaced].to_csv(file_path, index=False, encoding='utf-8-sig')
+                df.to_csv(file_path, mode='a', header=False, index=False, encoding='utf-8')
+            elif if_exists in ('append', 'upsert') and os.path.exists(file_path):
+                df.to_csv(file_path, mode='a', header=False, index=False, encoding='utf-8')
+            else:
+                df.to_csv(file_path, index=False, encoding='utf-8-sig')
             print(f"Datos guardados exitosamente en {file_path}")
 
         elif target_format == 'excel':
+            if if_exists != 'replace':
+                print(f"Error: El formato Excel no admite carga incremental (if_exists='{if_exists}')."); return
             file_path = kwargs.get('file_path', 'datos_limpios.xlsx')
             sheet_name = kwargs.get('sheet_name', 'Datos Limpios')
-            writer = pd.ExcelWriter(file_path, engine='xlsxwriter', datetime_format='yyyy-mm-dd')
-            df.to_excel(writer, sheet_name=sheet_name, index=False, header=False, startrow=1)
-            workbook = writer.book
-            worksheet = writer.sheets[sheet_name]
-            header_format = workbook.add_format({'bold': True, 'text_wrap': False, 'valign': 'vcenter', 'align': 'center', 'fg_color': '#DDEBF7', 'border': 1})
-            currency_format = workbook.add_format({'num_format': '#,##0.00 €'})
-            date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
-            integer_format = workbook.add_format({'num_format': '0'})
-
-            # --- Escribir CABECERA formateada y transformada ---
+            # Escritura en streaming (memoria constante); cabeceras formateadas y formatos de fecha/moneda/entero por columna
             print("Formateando cabeceras para Excel...")
-            for col_num, original_header_value in enumerate(df.columns.values):
-                formatted_header = original_header_value.replace('_', ' ').title() # Transformar cabecera
-                worksheet.write(0, col_num, formatted_header, header_format) # Escribir cabecera formateada
-
-            # --- Aplicar formato y autoajuste a las COLUMNAS de datos ---
-            for idx, col in enumerate(df.columns):
-                series = df[col]; max_len = 0
-                original_header_value = df.columns.values[idx] # Nombre original para buscar datos
-                formatted_header = original_header_value.replace('_', ' ').title() # Nombre formateado para medir ancho
-                try: max_len = max((series.astype(str).map(len).max(), len(formatted_header))) + 3
-                except: max_len = len(formatted_header) + 3
-                max_len = max(max_len, 12)
-                col_format = None
-                if pd.api.types.is_datetime64_any_dtype(series.dtype): col_format = date_format
-                elif col == 'precio_unitario': col_format = currency_format
-                elif col == 'cantidad': col_format = integer_format
-                worksheet.set_column(idx, idx, max_len, col_format)
-
-            writer.close()
+            _write_excel(df, file_path, sheet_name, max_rows=kwargs.get('max_rows', EXCEL_MAX_ROWS))
             print(f"Datos guardados exitosamente y formateados en {file_path}")
 
+        elif target_format in ('parquet', 'feather'):
+            try:
+                import pyarrow.feather as feather # Necesario para Parquet/Arrow
+            except ImportError:
+                print("Error: La librería 'pyarrow' es necesaria para Parquet/Feather. Instálala con: pip install pyarrow"); return
+            if if_exists == 'upsert' and target_format != 'parquet':
+                print(f"Error: El formato {target_format} no admite upsert; usa 'replace' o 'append'."); return
+            if target_format == 'parquet':
+                # Dataset particionado por mes de 'fecha' (carpetas mes=AAAA-MM); las columnas 'category' se guardan con diccionario
+                file_path = kwargs.get('file_path', 'datos_limpios_parquet')
+                if if_exists == 'upsert' and os.path.isdir(file_path):
+                    _upsert_parquet_partitions(df, file_path, kwargs.get('key', 'id_transaccion'), kwargs.get('changed_keys'))
+                    print(f"Datos guardados exitosamente en {file_path}"); return
+                if if_exists == 'replace' and os.path.isdir(file_path): shutil.rmtree(file_path)
+                partitioned = df.assign(mes=df['fecha'].dt.strftime('%Y-%m')) if 'fecha' in df.columns else df
+                partitioned.to_parquet(file_path, index=False, partition_cols=['mes'] if 'mes' in partitioned.columns else None)
+            else:
+                # Arrow IPC sin comprimir para poder leerlo con memory-mapping
+                file_path = kwargs.get('file_path', 'datos_limpios.feather')
+                if if_exists == 'append': print("Error: El formato Feather no admite carga incremental (if_exists='append')."); return
+                feather.write_feather(df.reset_index(drop=True), file_path, compression='uncompressed')
+            print(f"Datos guardados exitosamente en {file_path}")
+
+        elif target_format == 'rollups':
+            dir_path = kwargs.get('dir_path', 'rollups'); cube_file = os.path.join(dir_path, 'cubo.parquet')
+            if if_exists == 'upsert' and os.path.exists(cube_file):
+                # Cubo guardado + cubo del delta - aportación anterior de las filas sustituidas (`replaced_rows`)
+                cubes = [pd.read_parquet(cube_file), build_rollup_cube(df)]
+                replaced_rows = kwargs.get('replaced_rows')
+                if replaced_rows is not None and len(replaced_rows):
+                    removed = build_rollup_cube(replaced_rows); removed[ROLLUP_MEASURES] = -removed[ROLLUP_MEASURES]; cubes.append(removed)
+                cube = combine_rollup_cubes(cubes)
+                save_rollups(build_rollups(cube[cube['transacciones'] != 0]), dir_path)
+            elif if_exists == 'append':
+                print("Error: Los rollups no admiten 'append'; usa 'replace' o 'upsert'."); return
+            else: save_rollups(build_rollups(build_rollup_cube(df)), dir_path)
+
         elif target_format == 'sql':
             connection_string = kwargs.get('db_connection_string'); table_name = kwargs.get('table_name', 'transacciones_limpias')
             if not connection_string: print("Error: Se requiere 'db_connection_string' para SQL."); return
-            engine = create_engine(connection_string)
-            with engine.connect() as connection: df.to_sql(table_name, con=connection, if_exists='replace', index=False); print(f"Datos cargados a tabla '{table_name}'.")
+            batch_size = kwargs.get('batch_size', DEFAULT_BATCH_SIZE)
+            engine = get_sql_engine(connection_string)
+            insert_method = _sql_insert_method(engine)
+            batch_size = _sql_batch_size(engine, insert_method, batch_size, len(df.columns))
+            key = kwargs.get('key', 'id_transaccion')
+            # Clave como VARCHAR (no TEXT) para poder indexarla en todos los motores (MySQL no indexa TEXT sin longitud)
+            key_dtype = {key: String(255)} if if_exists == 'upsert' and df[key].dtype == object else None
+            start = time.perf_counter()
+            with engine.begin() as connection:
+                if if_exists == 'upsert' and inspect(connection).has_table(table_name):
+                    # Cargar en una tabla de paso con nombre único y sustituir las filas con la misma clave en una sola transacción
+                    staging_name = f"{table_name}_stg_{uuid.uuid4().hex[:8]}"
+                    df.to_sql(staging_name, con=connection, if_exists='fail', index=False, chunksize=batch_size, method=insert_method, dtype=key_dtype)
+                    metadata = MetaData()
+                    table = Table(table_name, metadata, autoload_with=connection)
+                    staging = Table(staging_name, metadata, autoload_with=connection)
+                    _create_key_index(connection, table, key) # También si la tabla se creó con 'replace'/'append' (sin índice)
+                    connection.execute(delete(table).where(table.c[key].in_(select(staging.c[key]))))
+                    connection.execute(insert(table).from_select(list(df.columns), select(*(staging.c[col] for col in df.columns))))
+                    staging.drop(connection)
+                else:
+                    df.to_sql(table_name, con=connection, if_exists='append' if if_exists == 'upsert' else if_exists, index=False,
+                              chunksize=batch_size, method=insert_method, dtype=key_dtype)
+                    if if_exists == 'upsert': # Índice sobre la clave para que los siguientes upserts sean rápidos
+                        _create_key_index(connection, Table(table_name, MetaData(), autoload_with=connection), key)
+            print(f"Datos cargados a tabla '{table_name}'. {_throughput(len(df), start)}")
 
         elif target_format == 'mongodb':
             # --- Bloque CORREGIDO para importar pymongo ---
             try:
-                from pymongo import MongoClient
+                from pymongo import ReplaceOne
                 from pymongo.errors import ConnectionFailure
             except ImportError:
                 print("Error: La librería 'pymongo' es necesaria para cargar en MongoDB.")
@@ -227,23 +1023,27 @@ def load_data(df, target_format='csv', **kwargs):
             connection_string = kwargs.get('db_connection_string', 'mongodb://localhost:27017/')
             db_name = kwargs.get('db_name', 'mi_base_de_datos')
             collection_name = kwargs.get('collection_name', 'transacciones_limpias')
+            batch_size = kwargs.get('batch_size', DEFAULT_BATCH_SIZE)
+            key = kwargs.get('key', 'id_transaccion')
             try:
-                client = MongoClient(connection_string, serverSelectionTimeoutMS=5000)
-                client.admin.command('ping') # Verificar conexión
-                db = client[db_name]
-                collection = db[collection_name]
-                df_copy = df.copy()
-                # Convertir Timestamps a datetime estándar para MongoDB
-                for col in df_copy.select_dtypes(include=['datetime64[ns]']).columns:
-                    df_copy[col] = df_copy[col].dt.to_pydatetime()
-                data_dict = df_copy.to_dict("records")
-                collection.drop() # Borrar colección existente
-                if data_dict: # Insertar solo si hay datos
-                    collection.insert_many(data_dict)
-                    print(f"Datos cargados exitosamente a MongoDB '{db_name}.{collection_name}'.")
-                else:
-                    print("No hay datos para insertar en MongoDB.")
-                client.close()
+                client = get_mongo_client(connection_string)
+                collection = client[db_name][collection_name]
+                start = time.perf_counter()
+                if if_exists == 'replace':
+                    collection.drop() # Borrar colección existente
+                if if_exists == 'upsert':
+                    collection.create_index(key)
+                datetime_cols = df.select_dtypes(include=['datetime64[ns]']).columns
+                for batch_start in range(0, len(df), batch_size):
+                    batch = df.iloc[batch_start:batch_start + batch_size].copy()
+                    # Convertir fechas a objetos datetime (Timestamp) que pymongo sabe serializar
+                    batch[datetime_cols] = batch[datetime_cols].astype(object)
+                    records = batch.to_dict("records")
+                    if if_exists == 'upsert':
+                        collection.bulk_write([ReplaceOne({key: doc[key]}, doc, upsert=True) for doc in records], ordered=False)
+                    else:
+                        collection.insert_many(records, ordered=False)
+                print(f"Datos cargados exitosamente a MongoDB '{db_name}.{collection_name}'. {_throughput(len(df), start)}")
             except ConnectionFailure:
                 print(f"Error: No se pudo conectar a MongoDB en {connection_string}. Asegúrate que el servidor esté corriendo.")
             except Exception as mongo_e:
@@ -253,16 +1053,398 @@ def load_data(df, target_format='csv', **kwargs):
     except Exception as e:
         print(f"Error durante la carga a {target_format}: {e}")
 
+# --- Pipeline por Bloques (Streaming) ---
+def run_pipeline_streaming(file_path, targets, chunksize=100_000, quarantine_target=None):
+    """Ejecuta el pipeline bloque a bloque: extrae, transforma y carga cada bloque de forma incremental.
+
+    `targets` es una lista de tuplas `(target_format, kwargs)` para `load_data` (CSV, Parquet, SQL o MongoDB).
+    El destino 'rollups' acumula cubos parciales por bloque y se escribe al final. Las filas
+    rechazadas por la validación se añaden bloque a bloque a `quarantine_target`, si se indica.
+    La memoria máxima depende de `chunksize`, no del tamaño del archivo. Los duplicados de
+    `id_transaccion` se eliminan entre bloques; la salida conserva el orden de entrada
+    (no se reordena globalmente por fecha).
+    """
+    seen_ids = {'id_hashes': np.empty(0, dtype=np.uint64)}
+    pending_replace = [True] * len(targets) # El primer bloque con datos reemplaza el destino
+    total_rows = 0
+    partial_cubes = []
+    quarantine_mode = 'replace'
+    for chunk in extract_data_chunks(file_path, chunksize=chunksize):
+        rejected = [] if quarantine_target else None
+        cleaned_chunk = apply_transformations(chunk, seen_ids=seen_ids, rejected=rejected)
+        if rejected:
+            write_quarantine(rejected, quarantine_target, if_exists=quarantine_mode); quarantine_mode = 'append'
+        if cleaned_chunk is None or cleaned_chunk.empty:
+            continue
+        total_rows += len(cleaned_chunk)
+        for i, (target_format, target_kwargs) in enumerate(targets):
+            if target_format == 'rollups':
+                partial_cubes.append(build_rollup_cube(cleaned_chunk)); continue
+            mode = 'replace' if pending_replace[i] else 'append'
+            load_data(cleaned_chunk, target_format=target_format, if_exists=mode, **target_kwargs)
+            pending_replace[i] = False
+    for target_format, target_kwargs in targets:
+        if target_format == 'rollups' and partial_cubes:
+            save_rollups(build_rollups(combine_rollup_cubes(partial_cubes)), target_kwargs.get('dir_path', 'rollups'))
+    if quarantine_target and quarantine_mode == 'replace': write_quarantine([], quarantine_target) # Ningún bloque tuvo rechazos
+    print(f"\nPipeline por bloques finalizado. Filas limpias cargadas: {total_rows}")
+    return total_rows
+
+# --- Ejecución Incremental (Marca de Agua) ---
+def _ids_file(state_file):
+    return os.path.splitext(state_file)[0] + '_ids.npz'
+
+def _file_digest(file_path, n_bytes=None):
+    """SHA-256 de los primeros `n_bytes` bytes de un archivo (o del archivo completo)."""
+    digest = hashlib.sha256(); remaining = n_bytes
+    with open(file_path, 'rb') as f:
+        while remaining is None or remaining > 0:
+            block = f.read(1 << 20 if remaining is None else min(1 << 20, remaining))
+            if not block: break
+            digest.update(block)
+            if remaining is not None: remaining -= len(block)
+    return digest.hexdigest()
+
+UNKNOWN_FILE = np.iinfo(np.uint32).max # Archivo de origen desconocido (estado de una versión anterior)
+STATE_ARRAYS = ('id_hashes', 'row_hashes', 'id_files', 'quarantine_hashes') # Se guardan en *_ids.npz, no en el JSON
+
+def load_incremental_state(state_file):
+    """Lee el estado incremental: archivos procesados, marca de agua y hashes de ids vistos (con su archivo de origen)."""
+    state = {'archivos': {}, 'marca_agua': None}
+    if os.path.exists(state_file):
+        with open(state_file, encoding='utf-8') as f: state.update(json.load(f))
+    ids_file = _ids_file(state_file)
+    if os.path.exists(ids_file):
+        with np.load(ids_file) as arrays:
+            state['id_hashes'], state['row_hashes'] = arrays['id_hashes'], arrays['row_hashes']
+            state['id_files'] = arrays['id_files'] if 'id_files' in arrays else np.full(len(state['id_hashes']), UNKNOWN_FILE, dtype=np.uint32)
+            state['quarantine_hashes'] = arrays['quarantine_hashes'] if 'quarantine_hashes' in arrays else np.empty(0, dtype=np.uint64)
+    else:
+        state['id_hashes'] = np.empty(0, dtype=np.uint64); state['row_hashes'] = np.empty(0, dtype=np.uint64)
+        state['id_files'] = np.empty(0, dtype=np.uint32); state['quarantine_hashes'] = np.empty(0, dtype=np.uint64)
+    return state
+
+def save_incremental_state(state, state_file):
+    """Guarda el estado incremental de forma atómica (JSON + arrays de hashes en .npz)."""
+    ids_file = _ids_file(state_file)
+    with open(ids_file + '.tmp', 'wb') as f:
+        np.savez(f, **{name: state[name] for name in STATE_ARRAYS})
+    os.replace(ids_file + '.tmp', ids_file)
+    metadata = {k: v for k, v in state.items() if k not in STATE_ARRAYS}
+    with open(state_file + '.tmp', 'w', encoding='utf-8') as f: json.dump(metadata, f, ensure_ascii=False, indent=2)
+    os.replace(state_file + '.tmp', state_file)
+
+def _read_new_rows(file_path, file_state, stat):
+    """Lee solo lo nuevo de un archivo modificado: la cola si solo se le añadieron filas,
+    o el archivo completo en cualquier otro caso. Devuelve `(df, solo_cola)`; df es None si la lectura falla."""
+    offset = file_state['bytes'] if file_state else 0
+    if 0 < offset < stat.st_size and _file_digest(file_path, offset) == file_state['sha256']:
+        with open(file_path, 'rb') as f:
+            f.seek(offset - 1)
+            if f.read(1) == b'\n': # El contenido previo termina en una línea completa
+                print(f"\n{file_path}: solo se añadieron datos; leyendo desde el byte {offset}.")
+                try: return pd.read_csv(f, dtype=str, delimiter=',', header=None, names=file_state['columnas']), True
+                except pd.errors.EmptyDataError: return pd.DataFrame(columns=file_state['columnas'], dtype=str), True
+    return extract_data(file_path), False
+
+def _filter_seen_rows(df, state, file_number, allow_updates=True):
+    """Deja solo las filas con `id_transaccion` nuevo o con contenido distinto al ya cargado,
+    y actualiza los hashes del estado (los ids nuevos se asocian al archivo `file_number`).
+    Solo se actualizan ids cargados antes desde el mismo archivo; el resto de ids ya cargados se descartan,
+    como en `remove_duplicates` (se conserva el primero). Con `allow_updates=False` (filas añadidas al final
+    de un archivo) no hay actualizaciones. Devuelve `(delta_df, ids_modificados)`."""
+    id_hashes = hash_ids(df['id_transaccion'])
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    known_ids, known_rows = state['id_hashes'], state['row_hashes'].copy()
+    pos, found = find_sorted(known_ids, id_hashes)
+    if len(known_ids) and allow_updates:
+        changed = found & (state['id_files'][pos] == file_number) & (known_rows[pos] != row_hashes)
+    else: changed = np.zeros(len(df), dtype=bool)
+    print(f"Filas nuevas: {(~found).sum()}, modificadas: {changed.sum()}, ya cargadas (omitidas): {(found & ~changed).sum()}")
+    known_rows[pos[changed]] = row_hashes[changed]
+    merged_ids = np.concatenate([known_ids, id_hashes[~found]])
+    order = np.argsort(merged_ids, kind='stable')
+    state['id_hashes'] = merged_ids[order]
+    state['row_hashes'] = np.concatenate([known_rows, row_hashes[~found]])[order]
+    state['id_files'] = np.concatenate([state['id_files'], np.full((~found).sum(), file_number, dtype=np.uint32)])[order]
+    return df[~found | changed], df.loc[changed, 'id_transaccion'].astype(str).tolist()
+
+def _new_quarantine_rows(rejected, state):
+    """Filas en cuarentena aún no escritas en ejecuciones anteriores (por hash de fila), para no duplicarlas
+    al releer un archivo entero; actualiza los hashes del estado."""
+    quarantine_df = build_quarantine(rejected)
+    if quarantine_df is None: return []
+    hashes = pd.util.hash_pandas_object(quarantine_df, index=False).to_numpy()
+    new_rows = ~np.isin(hashes, state['quarantine_hashes'])
+    if not new_rows.all(): print(f"Cuarentena: {(~new_rows).sum()} filas ya registradas en ejecuciones anteriores (omitidas).")
+    state['quarantine_hashes'] = np.union1d(state['quarantine_hashes'], hashes)
+    return [quarantine_df[new_rows]]
+
+def _update_watermark(df, state):
+    """Avanza la marca de agua (última `fecha` / `id_transaccion` procesados) e informa llegadas tardías."""
+    if df.empty or 'fecha' not in df.columns: return
+    watermark = state.get('marca_agua')
+    if watermark:
+        late_rows = (df['fecha'] < pd.Timestamp(watermark['fecha'])).sum()
+        if late_rows: print(f"Aviso: {late_rows} filas con fecha anterior a la marca de agua ({watermark['fecha']}).")
+    latest = df.loc[df['fecha'].idxmax()]
+    if not watermark or latest['fecha'] >= pd.Timestamp(watermark['fecha']):
+        state['marca_agua'] = {'fecha': latest['fecha'].strftime('%Y-%m-%d'), 'id_transaccion': str(latest['id_transaccion'])}
+
+DERIVED_FORMATS = ('parquet', 'rollups') # Destinos que en modo incremental se actualizan a partir del delta
+
+def run_pipeline_incremental(file_paths, targets, state_file='estado_etl.json', quarantine_target=None):
+    """Procesa solo los archivos/filas nuevos o modificados desde la última ejecución y hace upsert en los destinos.
+
+    El estado (`state_file` + `*_ids.npz`) guarda por archivo su tamaño, fecha de modificación y hash,
+    la marca de agua y un hash de 64 bits por `id_transaccion` junto al hash de la fila limpia.
+    Un id ya cargado con contenido distinto se actualiza solo si el archivo del que se cargó se releyó entero
+    (reescrito); en filas añadidas al final o en otros archivos se conserva la primera aparición. Las filas borradas en el origen no se eliminan.
+    Las filas rechazadas por la validación se añaden a `quarantine_target`, si se indica (una sola vez por fila).
+    Los destinos con ruta solo se actualizan a partir del delta si su tamaño y fecha coinciden con los guardados
+    en el estado; si no (p. ej. salida de una ejecución completa o estado borrado), el CSV se reemplaza por clave
+    y el dataset Parquet y los rollups se regeneran al final desde el CSV (`rebuild_derived_outputs`).
+    """
+    state = load_incremental_state(state_file)
+    outputs = state.setdefault('destinos', {}) # Firma (tamaño, mtime) de cada destino tras la última carga
+    target_path = lambda target_kwargs: target_kwargs.get('file_path') or target_kwargs.get('dir_path')
+    in_sync = {target_path(kwargs): os.path.exists(target_path(kwargs)) and _output_signature(target_path(kwargs)) == outputs.get(target_path(kwargs))
+               for _, kwargs in targets if target_path(kwargs)}
+    parquet_path = next((kwargs['file_path'] for target_format, kwargs in targets if target_format == 'parquet'), None)
+    total_rows = 0
+    for file_path in file_paths:
+        file_state = state['archivos'].get(file_path)
+        stat = os.stat(file_path)
+        if file_state and file_state['bytes'] == stat.st_size and file_state['mtime_ns'] == stat.st_mtime_ns:
+            print(f"\n{file_path}: sin cambios desde la última ejecución.")
+            continue
+        file_number = file_state['numero'] if file_state and 'numero' in file_state else \
+            1 + max((entry.get('numero', -1) for entry in state['archivos'].values()), default=-1)
+        raw_df, tail_only = _read_new_rows(file_path, file_state, stat)
+        if raw_df is None:
+            print(f"Error: No se pudo leer {file_path}; se reintentará en la próxima ejecución."); continue
+        columns = file_state['columnas'] if file_state and raw_df.columns.tolist() == file_state['columnas'] else raw_df.columns.tolist()
+        rejected = [] if quarantine_target else None
+        cleaned_df = apply_transformations(raw_df, rejected=rejected) if not raw_df.empty else None
+        if rejected: rejected = _new_quarantine_rows(rejected, state)
+        if rejected and not rejected[0].empty: write_quarantine(rejected, quarantine_target, if_exists='append')
+        if cleaned_df is not None and not cleaned_df.empty:
+            delta_df, changed_keys = _filter_seen_rows(cleaned_df, state, file_number, allow_updates=not tail_only)
+            _update_watermark(delta_df, state)
+            total_rows += len(delta_df)
+            # Filas anteriores de los ids actualizados (para restarlas de los rollups), antes de reescribir el Parquet
+            replaced_rows = read_parquet_rows(parquet_path, changed_keys) if changed_keys and in_sync.get(parquet_path) else None
+            for target_format, target_kwargs in targets:
+                path = target_path(target_kwargs)
+                if target_format in DERIVED_FORMATS and (not in_sync[path] or (target_format == 'rollups' and changed_keys and replaced_rows is None)):
+                    in_sync[path] = False; continue # Se regenera al final desde el CSV
+                keys = changed_keys if in_sync.get(path, True) else None # None: comprobar todas las claves del delta
+                load_data(delta_df, target_format=target_format, if_exists='upsert', changed_keys=keys, replaced_rows=replaced_rows, **target_kwargs)
+                if path and os.path.exists(path): outputs[path] = _output_signature(path); in_sync[path] = True
+        state['archivos'][file_path] = {'numero': file_number, 'bytes': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                                        'sha256': _file_digest(file_path, stat.st_size), 'columnas': columns}
+        save_incremental_state(state, state_file)
+    stale = [(target_format, kwargs) for target_format, kwargs in targets if target_format in DERIVED_FORMATS and not in_sync[target_path(kwargs)]]
+    csv_path = next((kwargs['file_path'] for target_format, kwargs in targets if target_format == 'csv'), None)
+    if stale and csv_path and os.path.exists(csv_path):
+        rebuild_derived_outputs(csv_path, stale)
+        for _, kwargs in stale: outputs[target_path(kwargs)] = _output_signature(target_path(kwargs))
+        save_incremental_state(state, state_file)
+    print(f"\nEjecución incremental finalizada. Filas nuevas o actualizadas: {total_rows}. Marca de agua: {state.get('marca_agua')}")
+    return total_rows
+
+def rebuild_derived_outputs(csv_path, targets):
+    """Regenera por completo destinos derivados (dataset Parquet, rollups) a partir del CSV acumulado.
+
+    Solo se usa si no coinciden con el estado incremental (primera ejecución, salidas borradas o modificadas);
+    se restauran los tipos de la transformación ('category' y textos vacíos en lugar de nulos).
+    """
+    print(f"\nRegenerando {', '.join(kwargs.get('file_path') or kwargs.get('dir_path') for _, kwargs in targets)} a partir de {csv_path}...")
+    df = cast_final_types(pd.read_csv(csv_path, dtype={'id_transaccion': str}, parse_dates=['fecha'], encoding='utf-8-sig'))
+    text_cols = [col for col in TITLE_CASE_COLUMNS if col in df.columns]
+    df[text_cols] = df[text_cols].fillna('')
+    df = df.astype({col: 'category' for col in load_normalization_rules() if col in df.columns})
+    df.sort_values(by='fecha', inplace=True, kind='stable')
+    for target_format, target_kwargs in targets:
+        load_data(df, target_format=target_format, **target_kwargs)
+
+# --- Caché de Resultados Limpios ---
+CACHE_DIR = '.cache_etl'
+CACHE_BUDGET_BYTES = 2 << 30 # Espacio máximo en disco de la caché (LRU)
+
+def transformation_fingerprint(rules_file=RULES_FILE):
+    """Huella de la versión de la transformación: código de este módulo, reglas (y catálogos que referencian),
+    formatos de fecha y versión de pandas."""
+    digest = hashlib.sha256()
+    with open(os.path.abspath(__file__), 'rb') as f: digest.update(f.read())
+    if os.path.exists(rules_file):
+        with open(rules_file, 'rb') as f: digest.update(f.read())
+        with open(rules_file, encoding='utf-8') as f: rules = json.load(f).get('validacion', {}).get('reglas', [])
+        for rule in rules: # Catálogos de reglas 'referencia' con 'archivo': editarlos invalida la caché
+            if rule.get('archivo'):
+                catalog = os.path.join(os.path.dirname(rules_file), rule['archivo'])
+                digest.update(_file_digest(catalog).encode() if os.path.exists(catalog) else b'-')
+    digest.update(repr(DATE_FORMATS).encode()); digest.update(pd.__version__.encode())
+    return digest.hexdigest()
+
+def _load_cache_index(cache_dir):
+    index_file = os.path.join(cache_dir, 'indice.json')
+    if not os.path.exists(index_file): return {'entradas': {}, 'entradas_hash': {}, 'salidas': {}}
+    with open(index_file, encoding='utf-8') as f: return json.load(f)
+
+def _save_cache_index(index, cache_dir):
+    index_file = os.path.join(cache_dir, 'indice.json')
+    with open(index_file + '.tmp', 'w', encoding='utf-8') as f: json.dump(index, f, ensure_ascii=False, indent=2)
+    os.replace(index_file + '.tmp', index_file)
+
+def _input_digest(file_path, index):
+    """SHA-256 del archivo de entrada; se reutiliza el calculado antes si el tamaño y la fecha de modificación no cambiaron."""
+    stat = os.stat(file_path); known = index['entradas_hash'].get(os.path.abspath(file_path))
+    if known and known['bytes'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns: return known['sha256']
+    sha256 = _file_digest(file_path)
+    index['entradas_hash'][os.path.abspath(file_path)] = {'bytes': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}
+    return sha256
+
+def evict_cache(index, cache_dir, budget_bytes=CACHE_BUDGET_BYTES, fingerprint=None):
+    """Elimina las entradas de otra versión de la transformación y, después, las menos usadas hasta caber en `budget_bytes`."""
+    entries = index['entradas']
+    stale = [key for key, entry in entries.items() if fingerprint and entry['huella'] != fingerprint]
+    by_last_use = sorted((key for key in entries if key not in stale), key=lambda key: entries[key]['ultimo_uso'])
+    total = sum(entries[key]['bytes'] for key in by_last_use)
+    while by_last_use and total > budget_bytes:
+        key = by_last_use.pop(0); stale.append(key); total -= entries[key]['bytes']
+    for key in stale:
+        for name in (f'{key}.parquet', f'{key}_cuarentena.parquet'):
+            with contextlib.suppress(FileNotFoundError): os.remove(os.path.join(cache_dir, name))
+        del entries[key]
+    if stale: print(f"Caché: {len(stale)} entradas eliminadas (reglas/código cambiados o fuera del presupuesto de disco).")
+
+def _output_signature(path):
+    """Tamaño y fecha de modificación de una salida (archivo o directorio), para detectar si se modificó."""
+    if os.path.isfile(path):
+        stat = os.stat(path); return [stat.st_size, stat.st_mtime_ns]
+    stats = [os.stat(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names]
+    return [sum(s.st_size for s in stats), max((s.st_mtime_ns for s in stats), default=0)]
+
+def output_is_current(path, key, cache_dir=CACHE_DIR):
+    """True si `path` se generó a partir de la entrada de caché `key` y no se ha modificado desde entonces."""
+    recorded = _load_cache_index(cache_dir)['salidas'].get(os.path.abspath(path)) if os.path.isdir(cache_dir) else None
+    return bool(recorded) and recorded['clave'] == key and os.path.exists(path) and _output_signature(path) == recorded['firma']
+
+def record_output(path, key, cache_dir=CACHE_DIR):
+    """Anota que `path` contiene el resultado de la entrada de caché `key`."""
+    if not os.path.exists(path): return
+    index = _load_cache_index(cache_dir)
+    index['salidas'][os.path.abspath(path)] = {'clave': key, 'firma': _output_signature(path)}
+    _save_cache_index(index, cache_dir)
+
+def cached_transform(file_path, transform=None, cache_dir=CACHE_DIR, budget_bytes=CACHE_BUDGET_BYTES, rules_file=RULES_FILE, rejected=None):
+    """Devuelve `(clave, df_limpio)` reutilizando el resultado guardado si la entrada y la transformación no cambiaron.
+
+    La clave combina el hash del contenido de `file_path` con `transformation_fingerprint`; el resultado
+    se guarda en Parquet dentro de `cache_dir` y la caché se recorta por uso (LRU) hasta `budget_bytes`.
+    Las filas en cuarentena se guardan siempre junto al resultado (vacías si no hay) y se añaden a `rejected`
+    si se pasa una lista; una entrada sin su cuarentena se trata como fallo de caché.
+    """
+    transform = transform or apply_transformations
+    os.makedirs(cache_dir, exist_ok=True)
+    index = _load_cache_index(cache_dir)
+    fingerprint = transformation_fingerprint(rules_file)
+    try: input_digest = _input_digest(file_path, index)
+    except FileNotFoundError:
+        print(f"Error: El archivo {file_path} no fue encontrado."); return None, None
+    key = hashlib.sha256(f"{input_digest}:{fingerprint}".encode()).hexdigest()[:32]
+    cache_file = os.path.join(cache_dir, f'{key}.parquet')
+    quarantine_file = os.path.join(cache_dir, f'{key}_cuarentena.parquet')
+    if key in index['entradas'] and os.path.exists(cache_file) and os.path.exists(quarantine_file):
+        with measure_stage('cache:lectura') as record:
+            cleaned_df = pd.read_parquet(cache_file)
+            if rejected is not None: rejected.append(pd.read_parquet(quarantine_file))
+            record['filas_salida'] = len(cleaned_df)
+        print(f"Caché: {file_path} sin cambios; se reutilizan {len(cleaned_df)} filas limpias de {cache_file}.")
+        index['entradas'][key]['ultimo_uso'] = time.time()
+        evict_cache(index, cache_dir, budget_bytes, fingerprint)
+        _save_cache_index(index, cache_dir)
+        return key, cleaned_df
+
+    raw_df = extract_data(file_path)
+    collected = [] # Se recogen aunque el llamador no las pida, para que la entrada sirva a ejecuciones con cuarentena
+    cleaned_df = transform(raw_df, rejected=collected)
+    if rejected is not None: rejected.extend(collected)
+    if cleaned_df is not None and not cleaned_df.empty:
+        with measure_stage('cache:escritura', rows_in=len(cleaned_df)):
+            cleaned_df.to_parquet(cache_file + '.tmp', engine='pyarrow')
+            os.replace(cache_file + '.tmp', cache_file)
+            quarantine_df = build_quarantine(collected)
+            if quarantine_df is None: quarantine_df = pd.DataFrame(columns=QUARANTINE_COLUMNS) # Marca: sin rechazos
+            quarantine_df.to_parquet(quarantine_file + '.tmp', engine='pyarrow'); os.replace(quarantine_file + '.tmp', quarantine_file)
+        cache_bytes = sum(os.path.getsize(path) for path in (cache_file, quarantine_file) if os.path.exists(path))
+        index['entradas'][key] = {'archivo': os.path.abspath(file_path), 'huella': fingerprint,
+                                  'bytes': cache_bytes, 'ultimo_uso': time.time()}
+        evict_cache(index, cache_dir, budget_bytes, fingerprint)
+        _save_cache_index(index, cache_dir)
+    return key, cleaned_df
+
 # --- Ejecución del Pipeline Completo ---
 if __name__ == "__main__":
-    raw_df = extract_data('datos_desordenados.csv')
-    cleaned_df = apply_transformations(raw_df)
-    if cleaned_df is not None and not cleaned_df.empty:
-        print("\nOrdenando datos por fecha antes de guardar...")
-        cleaned_df.sort_values(by='fecha', inplace=True)
-        load_data(cleaned_df, target_format='csv', file_path='datos_limpios.csv')
-        load_data(cleaned_df, target_format='excel', file_path='datos_limpios.xlsx')
-        # print("\nIntentando cargar a SQLite..."); load_data(cleaned_df, target_format='sql', db_connection_string='sqlite:///mi_base_etl.db', table_name='ventas_consolidadas')
-        # print("\nIntentando cargar a MongoDB..."); load_data(cleaned_df, target_format='mongodb', db_connection_string='mongodb://localhost:27017/', db_name='etl_db', collection_name='ventas_consolidadas')
+    parser = argparse.ArgumentParser(description="Pipeline ETL de limpieza de datos de ventas.")
+    parser.add_argument('--input', nargs='+', default=['datos_desordenados.csv'],
+                        help=f"Fuentes de entrada: CSV (.csv/.csv.gz), JSON lines, patrones glob ('tiendas/*.csv') o URLs SQL (<url>{SQL_SOURCE_SEPARATOR}<tabla>).")
+    parser.add_argument('--chunksize', type=int, default=None, help="Procesar por bloques de N filas (modo streaming, sin Excel).")
+    parser.add_argument('--workers', type=int, default=None, help="Transformar en paralelo con N procesos.")
+    parser.add_argument('--io-workers', type=int, default=8, help="Hilos para leer varias fuentes a la vez.")
+    parser.add_argument('--incremental', metavar='ESTADO', default=None, help="Procesar solo filas nuevas/modificadas usando el archivo de estado indicado (ej. estado_etl.json).")
+    parser.add_argument('--quiet', action='store_true', help="Omitir los diagnósticos costosos (head, info, conteos de nulos).")
+    parser.add_argument('--metrics', metavar='ARCHIVO', default=None, help="Escribir métricas por etapa en JSON lines ('-' = salida estándar).")
+    parser.add_argument('--no-cache', action='store_true', help=f"No reutilizar ni guardar resultados limpios en la caché ({CACHE_DIR}/).")
+    parser.add_argument('--quarantine', metavar='ARCHIVO', default='datos_cuarentena.csv', help="CSV donde se guardan las filas rechazadas con sus motivos ('' = no guardarlas).")
+    parser.add_argument('--cache-budget-mb', type=int, default=CACHE_BUDGET_BYTES >> 20, help="Espacio máximo en disco de la caché (MB).")
+    args = parser.parse_args()
+    configure_instrumentation(verbose=not args.quiet, metrics_file=args.metrics)
+    # Una sola ruta de archivo usa la extracción (y la caché) de siempre; varias fuentes, globs o URLs SQL, la multi-fuente
+    single_file = len(args.input) == 1 and source_kind(args.input[0]) == 'csv' and not glob.has_magic(args.input[0])
+    if args.chunksize and not single_file:
+        parser.error("El modo por bloques (--chunksize) solo admite un archivo CSV de entrada.")
+
+    parquet_target = ('parquet', {'file_path': 'datos_limpios_parquet'})
+    rollups_target = ('rollups', {'dir_path': 'rollups'})
+    quarantine_target = ('csv', {'file_path': args.quarantine}) if args.quarantine else None
+    if args.incremental:
+        # El modo incremental detecta cambios por tamaño/hash de archivo y lee colas de CSV: no admite SQL ni JSON
+        incremental_sources = expand_sources(args.input)
+        unsupported = [source for source in incremental_sources if source_kind(source) != 'csv']
+        if unsupported: parser.error(f"El modo incremental (--incremental) solo admite archivos CSV: {', '.join(map(_source_label, unsupported))}")
+        run_pipeline_incremental(incremental_sources, [('csv', {'file_path': 'datos_limpios.csv'}), parquet_target, rollups_target],
+                                 state_file=args.incremental, quarantine_target=quarantine_target)
+    elif args.chunksize:
+        run_pipeline_streaming(args.input[0], [('csv', {'file_path': 'datos_limpios.csv'}), parquet_target, rollups_target], chunksize=args.chunksize, quarantine_target=quarantine_target)
     else:
-        print("\nPipeline finalizado, pero no se generaron datos limpios para cargar.")
\ No newline at end of file
+        transform = functools.partial(apply_transformations_parallel, n_workers=args.workers) if args.workers else apply_transformations
+        rejected = [] if quarantine_target else None
+        if not single_file:
+            cache_key, cleaned_df = None, transform(extract_sources(args.input, max_workers=args.io_workers), rejected=rejected)
+        elif args.no_cache:
+            cache_key, cleaned_df = None, transform(extract_data(args.input[0]), rejected=rejected)
+        else:
+            cache_key, cleaned_df = cached_transform(args.input[0], transform, budget_bytes=args.cache_budget_mb << 20, rejected=rejected)
+        if quarantine_target:
+            if cache_key and output_is_current(args.quarantine, cache_key):
+                print(f"\n{args.quarantine} ya está actualizado (mismo resultado en caché); se omite la escritura.")
+            else:
+                write_quarantine(rejected, quarantine_target)
+                if cache_key: record_output(args.quarantine, cache_key)
+        if cleaned_df is not None and not cleaned_df.empty:
+            print("\nOrdenando datos por fecha antes de guardar...")
+            cleaned_df.sort_values(by='fecha', inplace=True)
+            outputs = [('csv', {'file_path': 'datos_limpios.csv'}), ('excel', {'file_path': 'datos_limpios.xlsx'}), parquet_target, rollups_target]
+            for target_format, target_kwargs in outputs:
+                output_path = target_kwargs.get('file_path') or target_kwargs.get('dir_path')
+                if cache_key and output_is_current(output_path, cache_key):
+                    print(f"\n{output_path} ya está actualizado (mismo resultado en caché); se omite la escritura."); continue
+                load_data(cleaned_df, target_format=target_format, **target_kwargs)
+                if cache_key: record_output(output_path, cache_key)
+            # print("\nIntentando cargar a SQLite..."); load_data(cleaned_df, target_format='sql', db_connection_string='sqlite:///mi_base_etl.db', table_name='ventas_consolidadas')
+            # print("\nIntentando cargar a MongoDB..."); load_data(cleaned_df, target_format='mongodb', db_connection_string='mongodb://localhost:27017/', db_name='etl_db', collection_name='ventas_consolidadas')
+        else:
+            print("\nPipeline finalizado, pero no se generaron datos limpios para cargar.")
+    close_connections()
\ No newline at end of file